@@ -0,0 +1,134 @@
+import io
+import os
+import gzip
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from aws_clients import lazy_client
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ S3 Client (created on first use)
+s3_client = lazy_client('s3')
+
+# ✅ Environment Variables (Placeholders for Security)
+AUDIT_BUCKET_NAME = os.getenv('AUDIT_BUCKET_NAME', '<AUDIT_LOG_BUCKET>')
+AUDIT_LOG_PREFIX = os.getenv('AUDIT_LOG_PREFIX', 'audit_logs')
+AUDIT_FLUSH_ON_RETURN = os.getenv('AUDIT_FLUSH_ON_RETURN', 'true').lower() == 'true'
+
+# ✅ Flush thresholds
+FLUSH_MAX_BYTES = 256 * 1024  # Uncompressed JSON-lines bytes
+FLUSH_MAX_AGE_SECONDS = 60
+MAX_BUFFERED_ENTRIES = 10000  # Drop oldest entries if S3 stays unreachable
+
+
+# ✅ Partition prefix for one hour: audit_logs/dt=YYYY-MM-DD/hour=HH/
+def partition_prefix(moment):
+    return f'{AUDIT_LOG_PREFIX}/dt={moment:%Y-%m-%d}/hour={moment:%H}/'
+
+
+class AuditLogBuffer:
+    """ ✅ Buffers JSON-lines audit entries and writes them as gzip objects with unique, partitioned keys """
+
+    def __init__(self):
+        self._lines = []
+        self._bytes = 0
+        self._first_at = None
+        self._lock = threading.Lock()
+
+    def append(self, entry):
+        line = json.dumps(entry, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            self._lines.append((entry['timestamp'], line))
+            self._bytes += len(line)
+            self._first_at = self._first_at or time.monotonic()
+            if len(self._lines) > MAX_BUFFERED_ENTRIES:
+                _, dropped = self._lines.pop(0)
+                self._bytes -= len(dropped)
+            due = self._bytes >= FLUSH_MAX_BYTES or time.monotonic() - self._first_at >= FLUSH_MAX_AGE_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+            self._bytes, self._first_at = 0, None
+        if not lines:
+            return 0
+
+        # ✅ One object per hour partition present in the buffer
+        partitions = {}
+        for timestamp, line in lines:
+            partitions.setdefault(partition_prefix(datetime.fromisoformat(timestamp)), []).append((timestamp, line))
+
+        written = 0
+        for prefix, entries in partitions.items():
+            key = f'{prefix}{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:12]}.jsonl.gz'
+            body = gzip.compress(''.join(line for _, line in entries).encode('utf-8'))
+            try:
+                s3_client.put_object(
+                    Bucket=AUDIT_BUCKET_NAME,
+                    Key=key,
+                    Body=body,
+                    ContentType='application/x-ndjson',
+                    ContentEncoding='gzip'
+                )
+                written += len(entries)
+            except Exception as e:
+                logger.warning('Audit log flush failed, re-buffering %d entries: %s', len(entries), e)
+                with self._lock:
+                    self._lines = entries + self._lines
+                    self._bytes += sum(len(line) for _, line in entries)
+                    self._first_at = self._first_at or time.monotonic()
+        return written
+
+
+# ✅ Shared buffer (survives across warm invocations)
+audit_buffer = AuditLogBuffer()
+
+
+# ✅ Function to record one audit entry
+def record(user_id, action, filename, **extra):
+    entry = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'user_id': user_id,
+        'action': action,
+        'filename': filename
+    }
+    entry.update(extra)
+    audit_buffer.append(entry)
+
+
+# ✅ Function to flush at the end of an invocation
+def flush(force=False):
+    if force or AUDIT_FLUSH_ON_RETURN:
+        return audit_buffer.flush()
+    return 0
+
+
+# ✅ Function to stream entries from a time range, only reading the hour partitions it covers
+def iter_entries(start, end, user_id=None, action=None):
+    start = start.astimezone(timezone.utc)
+    end = end.astimezone(timezone.utc)
+    paginator = s3_client.get_paginator('list_objects_v2')
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour <= end:
+        for page in paginator.paginate(Bucket=AUDIT_BUCKET_NAME, Prefix=partition_prefix(hour)):
+            for obj in page.get('Contents', []):
+                body = s3_client.get_object(Bucket=AUDIT_BUCKET_NAME, Key=obj['Key'])['Body']
+                with gzip.GzipFile(fileobj=body) as stream:
+                    for raw_line in io.TextIOWrapper(stream, encoding='utf-8'):
+                        entry = json.loads(raw_line)
+                        timestamp = datetime.fromisoformat(entry['timestamp'])
+                        if not start <= timestamp <= end:
+                            continue
+                        if user_id and entry.get('user_id') != user_id:
+                            continue
+                        if action and entry.get('action') != action:
+                            continue
+                        yield entry
+        hour += timedelta(hours=1)
@@ -0,0 +1,106 @@
+import threading
+import instrumentation
+
+# ✅ Shared, lazily created AWS clients
+# boto3 is imported on first use, every client comes from one boto3 session (one botocore
+# session, so endpoint and model data are loaded once), and each client or resource is
+# cached for the life of the container. Every API call is timed by instrumentation's botocore hooks.
+
+_session = None
+_clients = {}
+_resources = {}
+_tables = {}
+_lock = threading.RLock()
+
+
+def get_session():
+    """ ✅ Returns the container-wide boto3 session """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3
+                session = boto3.session.Session()
+                instrumentation.register_botocore_hooks(session)
+                _session = session
+    return _session
+
+
+def set_session(session):
+    """ ✅ Installs a preconfigured boto3 session (offline benchmarks, local runs) and drops cached clients;
+    call it before any client is used, since lazy proxies keep the client they first resolved """
+    global _session
+    with _lock:
+        instrumentation.register_botocore_hooks(session)
+        _session = session
+        _clients.clear()
+        _resources.clear()
+        _tables.clear()
+
+
+# ✅ botocore Config options accepted as plain keyword arguments (so they stay hashable cache-key parts)
+CONFIG_OPTIONS = ("signature_version",)
+
+
+def get_client(service_name, **kwargs):
+    """ ✅ Returns a cached low-level client; kwargs (e.g. endpoint_url, signature_version) are part of the cache key """
+    key = (service_name, tuple(sorted(kwargs.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                config_options = {name: kwargs.pop(name) for name in CONFIG_OPTIONS if name in kwargs}
+                if config_options:
+                    from botocore.config import Config
+                    kwargs["config"] = Config(**config_options)
+                client = get_session().client(service_name, **kwargs)
+                _clients[key] = client
+    return client
+
+
+def get_resource(service_name):
+    """ ✅ Returns a cached boto3 resource """
+    resource = _resources.get(service_name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(service_name)
+            if resource is None:
+                resource = get_session().resource(service_name)
+                _resources[service_name] = resource
+    return resource
+
+
+def get_table(table_name):
+    """ ✅ Returns a cached DynamoDB Table resource """
+    table = _tables.get(table_name)
+    if table is None:
+        table = get_resource("dynamodb").Table(table_name)
+        _tables[table_name] = table
+    return table
+
+
+class LazyProxy:
+    """ ✅ Stands in for a module-level client; builds the real one on first attribute access """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+
+    def __getattr__(self, name):
+        target = self._target
+        if target is None:
+            target = self._target = self._factory()
+        return getattr(target, name)
+
+
+def lazy_client(service_name, **kwargs):
+    return LazyProxy(lambda: get_client(service_name, **kwargs))
+
+
+def lazy_resource(service_name):
+    return LazyProxy(lambda: get_resource(service_name))
+
+
+def lazy_table(table_name):
+    return LazyProxy(lambda: get_table(table_name))
@@ -0,0 +1,142 @@
+""" ✅ Cold-start benchmark: import time and AWS client construction per Lambda handler
+
+Each measurement runs in a fresh interpreter, imports one handler module, then builds the
+clients that handler needs to serve one request. Time spent inside boto3 Session.client /
+Session.resource is reported separately from the rest of the import.
+
+    python benchmarks/cold_start.py                      # current tree
+    python benchmarks/cold_start.py --baseline HEAD~1    # compare against a git revision
+    python benchmarks/cold_start.py --runs 10 --json cold_start.json
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ✅ Clients each handler needs on its main request path (built lazily after the change)
+HANDLER_CLIENTS = {
+    "pkce_authentication": [("client", "cognito-idp"), ("client", "dynamodb")],
+    "dynamodb_handler": [("client", "cognito-idp"), ("client", "dynamodb")],
+    "chatbot_lambda": [("resource", "dynamodb"), ("client", "secretsmanager")],
+    "s3_presigned": [("client", "s3")],
+    "stripe_payment": [],
+    "stripe_webhook": [("resource", "dynamodb"), ("client", "sqs")],
+}
+
+# ✅ Runs inside the child interpreter; prints one JSON line
+CHILD_SCRIPT = r"""
+import sys, json, time, importlib, importlib.abc, importlib.util
+
+client_seconds = [0.0]
+
+def timed(method):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            client_seconds[0] += time.perf_counter() - started
+    return wrapper
+
+class PatchBoto3Session(importlib.abc.MetaPathFinder):
+    # Wraps boto3.session.Session.client/resource as soon as boto3 is imported
+    def find_spec(self, fullname, path, target=None):
+        if fullname != "boto3.session":
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        original_exec = spec.loader.exec_module
+        def exec_module(module):
+            original_exec(module)
+            module.Session.client = timed(module.Session.client)
+            module.Session.resource = timed(module.Session.resource)
+        spec.loader.exec_module = exec_module
+        return spec
+
+sys.meta_path.insert(0, PatchBoto3Session())
+name, clients = sys.argv[1], json.loads(sys.argv[2])
+
+started = time.perf_counter()
+importlib.import_module(name)
+import_seconds = time.perf_counter() - started
+clients_during_import = client_seconds[0]
+
+started = time.perf_counter()
+try:
+    import aws_clients
+except ImportError:
+    aws_clients = None  # Baseline tree: clients were already built at import time
+if aws_clients:
+    for kind, service in clients:
+        (aws_clients.get_resource if kind == "resource" else aws_clients.get_client)(service)
+first_use_seconds = time.perf_counter() - started
+
+print(json.dumps({
+    "imports_ms": (import_seconds - clients_during_import) * 1000,
+    "clients_ms": client_seconds[0] * 1000,
+    "total_ms": (import_seconds + first_use_seconds) * 1000,
+    "boto3_imported": "boto3" in sys.modules
+}))
+"""
+
+
+def measure(tree, handler, runs):
+    env = dict(os.environ, PYTHONPATH=tree, PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", CHILD_SCRIPT, handler, json.dumps(HANDLER_CLIENTS[handler])],
+            cwd=tree, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr else "failed"}
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    summary = {key: round(statistics.median(s[key] for s in samples), 2) for key in ("imports_ms", "clients_ms", "total_ms")}
+    summary["boto3_imported"] = samples[-1]["boto3_imported"]
+    return summary
+
+
+def export_revision(ref, directory):
+    archive = subprocess.run(["git", "archive", ref], cwd=REPO_ROOT, capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", directory], input=archive.stdout, check=True)
+
+
+def print_table(results, labels):
+    print(f"{'handler':<22}" + "".join(f"{label + ' imports/clients/total ms':>36}" for label in labels))
+    for handler in HANDLER_CLIENTS:
+        row = f"{handler:<22}"
+        for label in labels:
+            r = results[label][handler]
+            cell = r["error"][:34] if "error" in r else f"{r['imports_ms']:.0f} / {r['clients_ms']:.0f} / {r['total_ms']:.0f}"
+            row += f"{cell:>36}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", help="git revision to compare against (e.g. HEAD~1)")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per handler (median is reported)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as baseline_dir:
+        if args.baseline:
+            export_revision(args.baseline, baseline_dir)
+            results["before"] = {h: measure(baseline_dir, h, args.runs) for h in HANDLER_CLIENTS}
+        results["after"] = {h: measure(REPO_ROOT, h, args.runs) for h in HANDLER_CLIENTS}
+
+    print_table(results, list(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+""" ✅ Offline load test: replays recorded events against each Lambda handler with local stand-ins
+
+Each handler runs in a fresh interpreter wired to the stand-ins in benchmarks/stand_ins.py
+(moto-backed AWS, local Cognito JWKS/token endpoints, a fake Stripe API and a fake Make.com
+webhook), so nothing leaves the machine. For every handler it reports:
+
+- cold start: module import plus the first invocation (boto3 is already loaded by the
+  stand-ins; benchmarks/cold_start.py measures import cost in isolation)
+- p50/p95/p99 latency of the replayed fixtures at the chosen concurrency
+- downstream calls per request, by service
+
+Results are saved under benchmarks/results/ and compared with the previous run.
+
+    python benchmarks/load_test.py                                   # every handler
+    python benchmarks/load_test.py --handlers chatbot_lambda --requests 500 --concurrency 16
+    python benchmarks/load_test.py --latency make=50 --latency dynamodb=2 --fail-on-regression 15
+"""
+import os
+import sys
+import json
+import time
+import random
+import hmac
+import hashlib
+import argparse
+import statistics
+import subprocess
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import stand_ins
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+DEFAULT_FIXTURES = os.path.join(BENCH_DIR, "fixtures", "events.jsonl")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+HANDLERS = ["chatbot_lambda", "pkce_authentication", "dynamodb_handler", "s3_presigned", "stripe_payment", "stripe_webhook"]
+BENCH_USERS = 50
+APP_CLIENT_ID = "bench-app-client"
+STRIPE_WEBHOOK_SECRET = "whsec_bench"
+
+# ✅ Stand-in resources shared by every handler (table name -> keys, GSIs, LSIs)
+TABLES = {
+    "bench-users": ([("TS_user_id", "S")], (), ()),
+    "bench-profiles": ([("user_id", "S")], (), ()),
+    "bench-chat-history": ([("TS_user_id", "S"), ("message_ts", "S")], (), ()),
+    "bench-connections": ([("TS_user_id", "S"), ("connectionId", "S")], [("connectionId-index", [("connectionId", "S")])], ()),
+    "bench-response-cache": ([("cache_key", "S")], (), ()),
+    "bench-file-index": ([("user_id", "S"), ("filename", "S")], (), [("updated_at-index", [("updated_at", "S")])]),
+    "bench-token-refresh": ([("token_hash", "S")], (), ()),
+    "bench-stripe-events": ([("event_id", "S")], (), ())
+}
+BUCKETS = ["bench-files", "bench-audit"]
+QUEUE_NAME = "bench-stripe-events.fifo"
+SECRET_NAME = "bench-make-webhook"
+
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "USER_POOL_ID": "us-east-1_bench",
+    "COGNITO_REGION": "us-east-1",
+    "COGNITO_APP_CLIENT_ID": APP_CLIENT_ID,
+    "DYNAMODB_TABLE_NAME": "bench-users",
+    "CHAT_HISTORY_TABLE_NAME": "bench-chat-history",
+    "CONNECTIONS_TABLE_NAME": "bench-connections",
+    "RESPONSE_CACHE_TABLE_NAME": "bench-response-cache",
+    "FILE_INDEX_TABLE_NAME": "bench-file-index",
+    "TOKEN_REFRESH_TABLE_NAME": "bench-token-refresh",
+    "USERS_TABLE_NAME": "bench-users",
+    "STRIPE_EVENTS_TABLE_NAME": "bench-stripe-events",
+    "SECRETS_MANAGER_ARN": SECRET_NAME,
+    "BUCKET_NAME": "bench-files",
+    "AUDIT_BUCKET_NAME": "bench-audit",
+    "STRIPE_SECRET_KEY": "sk_test_bench",
+    "STRIPE_PLAN_PRICES": json.dumps({"pro": "price_bench_pro"}),
+    "STRIPE_WEBHOOK_SECRET": STRIPE_WEBHOOK_SECRET,
+    "STRIPE_SUCCESS_URL": "http://localhost/success",
+    "STRIPE_CANCEL_URL": "http://localhost/cancel"
+}
+# ✅ dynamodb_handler keys the users table on user_id rather than TS_user_id
+HANDLER_ENVIRONMENT = {
+    "dynamodb_handler": {"DYNAMODB_TABLE_NAME": "bench-profiles"}
+}
+
+
+class BenchContext:
+    """ ✅ Minimal Lambda context """
+    function_name = "bench"
+    memory_limit_in_mb = 1024
+    invoked_function_arn = "arn:aws:lambda:us-east-1:000000000000:function:bench"
+
+    def __init__(self, timeout_ms=900000):
+        self.aws_request_id = os.urandom(8).hex()
+        self.deadline = time.time() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.time()) * 1000)
+
+
+def load_fixtures(path, handler=None):
+    with open(path) as f:
+        fixtures = [json.loads(line) for line in f if line.strip()]
+    return [fixture for fixture in fixtures if handler is None or fixture["handler"] == handler]
+
+
+def percentile(sorted_values, p):
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize_latencies(samples_ms):
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {}
+    return {
+        "p50": round(percentile(ordered, 50), 2),
+        "p95": round(percentile(ordered, 95), 2),
+        "p99": round(percentile(ordered, 99), 2),
+        "mean": round(statistics.fmean(ordered), 2),
+        "max": round(ordered[-1], 2)
+    }
+
+
+# ✅ Worker side: runs inside the fresh interpreter for one handler
+class EventFactory:
+    """ ✅ Turns fixture templates into concrete events ({{USER_ID}}, {{ACCESS_TOKEN}}, {{UNIQUE}}, {{NOW}}) """
+
+    def __init__(self, services):
+        self.users = [f"bench-user-{i}" for i in range(BENCH_USERS)]
+        self.access_tokens = {user_id: services.issue_tokens(user_id)["access_token"] for user_id in self.users}
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def build(self, fixture):
+        with self.lock:
+            self.counter += 1
+            unique = f"{os.getpid()}-{self.counter}"
+        user_id = random.choice(self.users)
+        now = str(int(time.time()))
+        text = json.dumps(fixture["event"])
+        text = text.replace('\\"{{NOW}}\\"', now).replace('"{{NOW}}"', now).replace("{{NOW}}", now)
+        text = (text.replace("{{USER_ID}}", user_id)
+                    .replace("{{ACCESS_TOKEN}}", self.access_tokens[user_id])
+                    .replace("{{UNIQUE}}", unique))
+        event = json.loads(text)
+        if fixture.get("sign") == "stripe":
+            timestamp = str(int(time.time()))
+            signature = hmac.new(STRIPE_WEBHOOK_SECRET.encode("utf-8"), f"{timestamp}.{event['body']}".encode("utf-8"), hashlib.sha256).hexdigest()
+            event.setdefault("headers", {})["Stripe-Signature"] = f"t={timestamp},v1={signature}"
+        return event
+
+
+def is_expected_status(fixture, status):
+    """ Fixtures expect a 2xx unless they set "expect_status" (e.g. to benchmark a rejection path) """
+    if "expect_status" in fixture:
+        return status == fixture["expect_status"]
+    return isinstance(status, int) and 200 <= status < 300
+
+
+def setup_stand_ins(meter, services):
+    import aws_clients
+    session = aws_clients.get_session()
+    for name, (keys, gsis, lsis) in TABLES.items():
+        stand_ins.create_table(session, name, keys, gsis, lsis)
+    s3 = session.client("s3")
+    for bucket in BUCKETS:
+        s3.create_bucket(Bucket=bucket)
+    session.client("secretsmanager").create_secret(Name=SECRET_NAME, SecretString=json.dumps({"webhook_url": f"{services.url}/make"}))
+    queue_url = session.client("sqs").create_queue(QueueName=QUEUE_NAME, Attributes={"FifoQueue": "true"})["QueueUrl"]
+    os.environ["STRIPE_EVENTS_QUEUE_URL"] = queue_url
+
+    dynamodb = session.client("dynamodb")
+    for i in range(BENCH_USERS):
+        user_id = f"bench-user-{i}"
+        dynamodb.put_item(TableName="bench-users", Item={"TS_user_id": {"S": user_id}, "plan": {"S": "free"}, "payment_status": {"S": "inactive"}})
+        dynamodb.put_item(TableName="bench-profiles", Item={"user_id": {"S": user_id}, "extra_data": {"S": "{}"}})
+        s3.put_object(Bucket="bench-files", Key=f"UserData/{user_id}/report.pdf", Body=b"%PDF-1.4 bench")
+    # ✅ Setup traffic is not part of any measurement
+    meter.reset()
+
+
+def run_worker(args):
+    import importlib
+    sys.path.insert(0, REPO_ROOT)
+
+    os.environ.update(ENVIRONMENT)
+    os.environ.update(HANDLER_ENVIRONMENT.get(args.worker, {}))
+    os.environ.setdefault("CONTEXT_INDEX_DIR", os.path.join("/tmp", f"bench_context_{os.getpid()}"))
+
+    meter = stand_ins.DownstreamMeter(dict(parse_latency(args.latency)))
+    services = stand_ins.LocalServices(meter, APP_CLIENT_ID)
+    os.environ["COGNITO_TOKEN_URL"] = f"{services.url}/oauth2/token"
+    os.environ["COGNITO_JWKS_URL"] = f"{services.url}/jwks.json"
+    stand_ins.install_aws(meter)
+    setup_stand_ins(meter, services)
+
+    import stripe
+    stripe.api_base = services.url
+
+    fixtures = load_fixtures(args.fixtures, args.worker)
+    if not fixtures:
+        print(json.dumps({"handler": args.worker, "error": "no fixtures"}))
+        return
+    factory = EventFactory(services)
+
+    # ✅ Cold start: import plus first invocation
+    started = time.perf_counter()
+    module = importlib.import_module(args.worker)
+    import_ms = (time.perf_counter() - started) * 1000
+    first_event = factory.build(fixtures[0])
+    started = time.perf_counter()
+    module.lambda_handler(first_event, BenchContext())
+    first_invoke_ms = (time.perf_counter() - started) * 1000
+    cold_calls = meter.snapshot()
+    meter.reset()
+
+    # ✅ Warm replay at the requested concurrency (weighted round-robin over fixtures)
+    schedule = [fixture for fixture in fixtures for _ in range(fixture.get("weight", 1))]
+    samples = []
+    errors = []
+    samples_lock = threading.Lock()
+
+    def invoke(i):
+        fixture = schedule[i % len(schedule)]
+        event = factory.build(fixture)
+        started = time.perf_counter()
+        try:
+            response = module.lambda_handler(event, BenchContext())
+            status = response.get("statusCode", 200) if isinstance(response, dict) else 200
+            failed = not is_expected_status(fixture, status) or bool(isinstance(response, dict) and response.get("batchItemFailures"))
+        except Exception as e:
+            failed, status = True, type(e).__name__
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with samples_lock:
+            samples.append((fixture["name"], elapsed_ms))
+            if failed:
+                errors.append(f"{fixture['name']}: {status}")
+
+    replay_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(invoke, range(args.requests)))
+    replay_seconds = time.perf_counter() - replay_started
+    calls = meter.snapshot()
+
+    by_fixture = {}
+    for name, elapsed_ms in samples:
+        by_fixture.setdefault(name, []).append(elapsed_ms)
+    print(json.dumps({
+        "handler": args.worker,
+        "cold_start_ms": {"import": round(import_ms, 2), "first_invoke": round(first_invoke_ms, 2), "total": round(import_ms + first_invoke_ms, 2)},
+        "cold_start_calls": cold_calls,
+        "requests": len(samples),
+        "concurrency": args.concurrency,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "throughput_rps": round(len(samples) / replay_seconds, 1) if replay_seconds else None,
+        "latency_ms": summarize_latencies([elapsed_ms for _, elapsed_ms in samples]),
+        "by_fixture": {name: summarize_latencies(values) for name, values in by_fixture.items()},
+        "downstream_per_request": {target: round(count / len(samples), 2) for target, count in sorted(calls.items())}
+    }))
+    services.close()
+
+
+# ✅ Runner side
+def parse_latency(values):
+    for value in values or []:
+        target, _, ms = value.partition("=")
+        yield target, float(ms)
+
+
+def run_handler(handler, args):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", handler,
+               "--requests", str(args.requests), "--concurrency", str(args.concurrency), "--fixtures", args.fixtures]
+    for value in args.latency or []:
+        command += ["--latency", value]
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(command, cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"handler": handler, "error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(lines[-1])
+
+
+def load_previous():
+    path = os.path.join(RESULTS_DIR, "latest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(run):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = run["started_at"].replace(":", "").replace("-", "")
+    for path in (os.path.join(RESULTS_DIR, f"run-{stamp}.json"), os.path.join(RESULTS_DIR, "latest.json")):
+        with open(path, "w") as f:
+            json.dump(run, f, indent=2)
+
+
+def change(current, previous):
+    if not previous:
+        return ""
+    return f"{(current - previous) / previous * 100:+.0f}%"
+
+
+def print_report(run, previous):
+    previous_results = {r["handler"]: r for r in (previous or {}).get("results", []) if "error" not in r}
+    print(f"{'handler':<22}{'cold ms':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>8}{'errors':>8}  {'vs previous (cold / p95)':<26}downstream calls per request")
+    regressions = []
+    for r in run["results"]:
+        if "error" in r:
+            print(f"{r['handler']:<22}{r['error'][:90]}")
+            continue
+        latency, prev = r["latency_ms"], previous_results.get(r["handler"])
+        cold = r["cold_start_ms"]["total"]
+        delta = ""
+        if prev:
+            delta = f"{change(cold, prev['cold_start_ms']['total'])} / {change(latency['p95'], prev['latency_ms']['p95'])}"
+            regressions.append((r["handler"], "cold_start", cold, prev["cold_start_ms"]["total"]))
+            regressions.append((r["handler"], "p95", latency["p95"], prev["latency_ms"]["p95"]))
+        calls = ", ".join(f"{target} {count:g}" for target, count in r["downstream_per_request"].items())
+        print(f"{r['handler']:<22}{cold:>10.0f}{latency['p50']:>9.1f}{latency['p95']:>9.1f}{latency['p99']:>9.1f}"
+              f"{str(r['throughput_rps']):>8}{r['errors']:>8}  {delta:<26}{calls}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--handlers", nargs="+", choices=HANDLERS, default=HANDLERS)
+    parser.add_argument("--requests", type=int, default=200, help="warm invocations per handler")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent invocations during the replay")
+    parser.add_argument("--latency", action="append", metavar="TARGET=MS",
+                        help="injected latency, e.g. make=300, dynamodb=4, aws=5 (all AWS services), jwks, token, stripe")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="JSON-lines event fixtures")
+    parser.add_argument("--no-save", action="store_true", help="do not write benchmarks/results/")
+    parser.add_argument("--fail-on-regression", type=float, metavar="PERCENT",
+                        help="exit 1 if cold start or p95 got worse than the previous run by more than PERCENT")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_worker(args)
+
+    run = {
+        "started_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "settings": {"requests": args.requests, "concurrency": args.concurrency, "latency": args.latency or []},
+        "results": [run_handler(handler, args) for handler in args.handlers]
+    }
+    previous = load_previous()
+    if previous and previous.get("settings") != run["settings"]:
+        print("Note: previous run used different settings; comparisons are indicative only")
+    regressions = print_report(run, previous)
+    if not args.no_save:
+        save_results(run)
+
+    if args.fail_on_regression is not None:
+        worse = [r for r in regressions if r[3] and (r[2] - r[3]) / r[3] * 100 > args.fail_on_regression]
+        for handler, metric, current, before in worse:
+            print(f"Regression: {handler} {metric} {before:.1f} -> {current:.1f} ms")
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+""" ✅ Local stand-ins for every downstream the Lambda handlers call, with injected latency
+
+- AWS: moto's in-memory DynamoDB, S3, Secrets Manager and SQS behind a dedicated boto3 session
+  (installed with aws_clients.set_session); Cognito and the API Gateway management API get
+  canned responses, since the handlers only need their success paths.
+- HTTP: one local server for the Cognito JWKS and token endpoints (tokens signed with a
+  generated RSA key), the Stripe API (stripe.api_base) and the Make.com webhook.
+
+Every downstream call sleeps for its configured latency and is counted by DownstreamMeter.
+Requires: boto3, moto, PyJWT, cryptography, requests (plus numpy and stripe for the handlers).
+"""
+import json
+import time
+import uuid
+import threading
+from collections import Counter
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_LATENCY_MS = {
+    "aws": 5,  # Default for every AWS service without its own entry
+    "jwks": 20,
+    "token": 40,
+    "stripe": 80,
+    "make": 300
+}
+
+# ✅ Canned responses for AWS operations moto is not used for
+CANNED_RESPONSES = {
+    ("cognito-idp", "AdminUpdateUserAttributes"): lambda params: {},
+    ("cognito-idp", "GetUser"): lambda params: {
+        "Username": "bench-user",
+        "UserAttributes": [{"Name": "email", "Value": "bench@example.com"}, {"Name": "profile", "Value": "bench"}]
+    },
+    ("apigatewaymanagementapi", "PostToConnection"): lambda params: {},
+    ("apigatewaymanagementapi", "DeleteConnection"): lambda params: {}
+}
+
+
+class DownstreamMeter:
+    """ ✅ Counts downstream calls per target and applies the injected latency """
+
+    def __init__(self, latency_ms=None):
+        self.latency_ms = dict(DEFAULT_LATENCY_MS, **(latency_ms or {}))
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def call(self, target, family=None):
+        with self.lock:
+            self.calls[target] += 1
+        delay = self.latency_ms.get(target, self.latency_ms.get(family, 0))
+        if delay:
+            time.sleep(delay / 1000)
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+class CannedHTTPResponse:
+    status_code = 200
+    headers = {}
+    content = b""
+
+
+# ✅ AWS stand-ins
+def install_aws(meter, region="us-east-1"):
+    """ ✅ Starts moto, builds a metered boto3 session and hands it to aws_clients; returns the session """
+    import boto3
+    from moto import mock_aws
+    import aws_clients
+
+    mock = mock_aws()
+    mock.start()
+    session = boto3.session.Session(region_name=region)
+
+    def before_call(model, params, **kwargs):
+        service = model.service_model.service_name
+        meter.call(service, "aws")
+        canned = CANNED_RESPONSES.get((service, model.name))
+        if canned:
+            return CannedHTTPResponse(), canned(params)
+        return None
+
+    session.events.register("before-call", before_call)
+    aws_clients.set_session(session)
+    return session
+
+
+def create_table(session, name, keys, gsis=(), lsis=()):
+    """ keys: [(attribute, type)] with the hash key first; gsis/lsis: [(index_name, [(attribute, type)])] """
+    attributes = dict(keys)
+    for _, index_keys in (*gsis, *lsis):
+        attributes.update(index_keys)
+
+    def schema(index_keys):
+        return [{"AttributeName": a, "KeyType": "HASH" if i == 0 else "RANGE"} for i, (a, _) in enumerate(index_keys)]
+
+    kwargs = {
+        "TableName": name,
+        "KeySchema": schema(keys),
+        "AttributeDefinitions": [{"AttributeName": a, "AttributeType": t} for a, t in attributes.items()],
+        "BillingMode": "PAY_PER_REQUEST"
+    }
+    if gsis:
+        kwargs["GlobalSecondaryIndexes"] = [
+            {"IndexName": index, "KeySchema": schema(index_keys), "Projection": {"ProjectionType": "ALL"}}
+            for index, index_keys in gsis
+        ]
+    if lsis:
+        kwargs["LocalSecondaryIndexes"] = [
+            {"IndexName": index, "KeySchema": schema([keys[0], *index_keys]), "Projection": {"ProjectionType": "ALL"}}
+            for index, index_keys in lsis
+        ]
+    session.client("dynamodb").create_table(**kwargs)
+
+
+# ✅ HTTP stand-ins: Cognito JWKS/token endpoints, Stripe API, Make.com webhook
+class LocalServices:
+    """ ✅ Threaded local HTTP server; url is http://127.0.0.1:<port> """
+
+    def __init__(self, meter, audience, make_reply="Here is how to automate that workflow."):
+        import jwt
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        self.meter = meter
+        self.audience = audience
+        self.make_reply = make_reply
+        self.kid = "bench-key"
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.private_pem = private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+        self.jwks = {"keys": [dict(jwk, kid=self.kid, alg="RS256", use="sig")]}
+        self.checkout_sessions = {}
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+    # ✅ Tokens
+    def sign(self, claims):
+        import jwt
+        return jwt.encode(claims, self.private_pem, algorithm="RS256", headers={"kid": self.kid})
+
+    def issue_tokens(self, user_id, include_refresh=True):
+        now = int(time.time())
+        base = {"sub": user_id, "aud": self.audience, "iss": self.url, "iat": now, "exp": now + 3600}
+        tokens = {
+            "id_token": self.sign(dict(base, token_use="id", email=f"{user_id}@example.com", **{"cognito:username": user_id})),
+            "access_token": self.sign(dict(base, token_use="access", jti=uuid.uuid4().hex)),
+            "expires_in": 3600,
+            "token_type": "Bearer"
+        }
+        if include_refresh:
+            tokens["refresh_token"] = f"refresh-{user_id}"
+        return tokens
+
+    def token_grant(self, form):
+        grant = form.get("grant_type")
+        if grant == "authorization_code":
+            # ✅ Fixture codes look like "<user_id>:<anything>"
+            user_id = (form.get("code") or "").split(":", 1)[0]
+            return self.issue_tokens(user_id) if user_id else None
+        if grant == "refresh_token" and (form.get("refresh_token") or "").startswith("refresh-"):
+            return self.issue_tokens(form["refresh_token"][len("refresh-"):], include_refresh=False)
+        return None
+
+    # ✅ Stripe
+    def stripe_price(self, price_id):
+        return {
+            "id": price_id, "object": "price", "active": True, "currency": "usd", "unit_amount": 3900,
+            "product": "prod_bench", "recurring": {"interval": "month", "interval_count": 1}, "type": "recurring"
+        }
+
+    def stripe_checkout(self, idempotency_key):
+        with self.lock:
+            session = self.checkout_sessions.get(idempotency_key)
+            if session is None:
+                session_id = f"cs_bench_{uuid.uuid4().hex[:16]}"
+                session = {"id": session_id, "object": "checkout.session", "url": f"{self.url}/pay/{session_id}"}
+                if idempotency_key:
+                    self.checkout_sessions[idempotency_key] = session
+            return session
+
+    def make_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoints
+
+            def log_message(self, *args):
+                pass
+
+            def read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length).decode("utf-8") if length else ""
+
+            def send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/jwks.json":
+                    services.meter.call("jwks")
+                    return self.send_json(200, services.jwks)
+                if path.startswith("/v1/prices/"):
+                    services.meter.call("stripe")
+                    return self.send_json(200, services.stripe_price(path.rsplit("/", 1)[-1]))
+                return self.send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self.read_body()
+                if path == "/oauth2/token":
+                    services.meter.call("token")
+                    form = {k: v[0] for k, v in parse_qs(body).items()}
+                    tokens = services.token_grant(form)
+                    return self.send_json(200, tokens) if tokens else self.send_json(400, {"error": "invalid_grant"})
+                if path == "/v1/checkout/sessions":
+                    services.meter.call("stripe")
+                    return self.send_json(200, services.stripe_checkout(self.headers.get("Idempotency-Key")))
+                if path == "/make":
+                    services.meter.call("make")
+                    return self.send_json(200, {"response": services.make_reply})
+                return self.send_json(404, {"error": "not found"})
+
+        return Handler
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from aws_clients import lazy_client
+from instrumentation import submit
+from dynamodb_codec import batch_get_items, batch_write_items
+from dynamodb_handler import cognito_client, USER_POOL_ID, TABLE_NAME, ALLOWED_UPDATES
+import profile_cache
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ AWS Clients (created on first use)
+s3_client = lazy_client("s3")
+
+# ✅ Bulk Update Settings (Placeholders for Security)
+# Input: JSON lines, one update per line, shaped like the single-user request body plus user_id:
+#   {"user_id": "...", "custom:subscription_status": "active", "extra_data": {"plan": "pro"}}
+# Checkpoints and reports live under s3://BULK_UPDATE_BUCKET/bulk_updates/<job_id>/.
+BULK_UPDATE_BUCKET = os.getenv("BULK_UPDATE_BUCKET", "<S3_BULK_UPDATE_BUCKET>")
+BULK_UPDATE_PREFIX = "bulk_updates"
+COGNITO_UPDATE_RPS = float(os.getenv("COGNITO_UPDATE_RPS", "20"))  # Stay under the AdminUpdateUserAttributes quota
+COGNITO_MAX_WORKERS = 8
+COGNITO_MAX_RETRIES = 5
+COGNITO_THROTTLE_CODES = ("TooManyRequestsException", "ThrottlingException", "LimitExceededException")
+BATCH_RECORDS = 100  # One BatchGetItem per batch
+CHECKPOINT_EVERY_RECORDS = 1000
+STOP_MARGIN_MS = 60 * 1000  # Leave time to write the report and checkpoint
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class TokenBucket:
+    """ ✅ Thread-safe token bucket; acquire() blocks until one more call fits under the rate """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """ ✅ Called after a throttle so every worker slows down, not just the one that was throttled """
+        with self.lock:
+            self.tokens = min(self.tokens, 0.0)
+
+
+cognito_bucket = TokenBucket(COGNITO_UPDATE_RPS)
+cognito_executor = ThreadPoolExecutor(max_workers=COGNITO_MAX_WORKERS)
+
+
+# ✅ Function to update one user's Cognito attributes under the shared rate limit; returns an error or None
+def update_cognito_attributes(user_id, attributes):
+    for attempt in range(COGNITO_MAX_RETRIES + 1):
+        cognito_bucket.acquire()
+        try:
+            cognito_client.admin_update_user_attributes(
+                UserPoolId=USER_POOL_ID,
+                Username=user_id,
+                UserAttributes=[{"Name": key, "Value": value} for key, value in attributes.items()]
+            )
+            return None
+        except ClientError as e:
+            error = e.response.get("Error", {})
+            if error.get("Code") not in COGNITO_THROTTLE_CODES or attempt == COGNITO_MAX_RETRIES:
+                return f"{error.get('Code')}: {error.get('Message', '')}"
+            cognito_bucket.drain()
+            time.sleep(random.uniform(0, min(5.0, 0.2 * (2 ** attempt))))
+        except Exception as e:
+            return str(e)
+
+
+def merge_extra_data(current, updates):
+    try:
+        existing = json.loads(current) if current else {}
+    except ValueError:
+        existing = {}
+    return {**(existing if isinstance(existing, dict) else {}), **updates}
+
+
+# ✅ Function to merge extra_data for many users: BatchGetItem, merge, BatchWriteItem; returns {user_id: error}
+def write_extra_data(updates):
+    """ Read-merge-write is not atomic: a single-user update landing between the read and the
+    write for the same user is overwritten, so run backfills outside peak traffic """
+    if not updates:
+        return {}
+    try:
+        keys = [{"user_id": user_id} for user_id in updates]
+        existing = {item["user_id"]["S"]: item for item in batch_get_items(TABLE_NAME, keys, raw=True)}
+        items = []
+        for user_id, extra_data in updates.items():
+            item = existing.get(user_id) or {"user_id": {"S": user_id}}
+            merged = merge_extra_data(item.get("extra_data", {}).get("S"), extra_data)
+            items.append({**item, "extra_data": {"S": json.dumps(merged)}})
+        unprocessed = batch_write_items(TABLE_NAME, items, raw=True)
+    except Exception as e:
+        logger.error("Bulk DynamoDB write failed: %s", e)
+        return {user_id: str(e) for user_id in updates}
+    return {item["user_id"]["S"]: "Unprocessed after retries" for item in unprocessed}
+
+
+# ✅ Function to validate one input line; returns (record, error)
+def parse_record(raw):
+    try:
+        record = json.loads(raw)
+    except ValueError:
+        return None, "Invalid JSON"
+    if not isinstance(record, dict) or not isinstance(record.get("user_id"), str) or not record["user_id"]:
+        return None, "Missing user_id"
+
+    attributes = {key: value for key, value in record.items() if key not in ("user_id", "extra_data")}
+    unknown = sorted(set(attributes) - set(ALLOWED_UPDATES))
+    if unknown:
+        return None, f"Unsupported fields: {', '.join(unknown)}"
+    if not all(isinstance(value, str) for value in attributes.values()):
+        return None, "Attribute values must be strings"
+    extra_data = record.get("extra_data")
+    if extra_data is not None and not isinstance(extra_data, dict):
+        return None, "extra_data must be an object"
+    if not attributes and extra_data is None:
+        return None, "No valid fields to update."
+    return {"user_id": record["user_id"], "attributes": attributes, "extra_data": extra_data}, None
+
+
+# ✅ Function to apply one batch of lines; Cognito calls run in the pool while DynamoDB is written
+def process_batch(lines):
+    """ lines: [(line_number, raw_bytes)]; returns one result per line, in order """
+    results = {}
+    users = {}
+    for line_number, raw in lines:
+        record, error = parse_record(raw)
+        if error:
+            results[line_number] = {"line": line_number, "status": "failed", "errors": {"input": error}}
+            continue
+        # ✅ Several lines for one user collapse into one Cognito call and one item write, applied in file order
+        user = users.setdefault(record["user_id"], {"lines": [], "attributes": {}, "extra_data": None})
+        user["lines"].append(line_number)
+        user["attributes"].update(record["attributes"])
+        if record["extra_data"] is not None:
+            user["extra_data"] = {**(user["extra_data"] or {}), **record["extra_data"]}
+
+    cognito_futures = {
+        user_id: submit(cognito_executor, update_cognito_attributes, user_id, user["attributes"])
+        for user_id, user in users.items() if user["attributes"]
+    }
+    dynamodb_errors = write_extra_data({
+        user_id: user["extra_data"] for user_id, user in users.items() if user["extra_data"] is not None
+    })
+
+    for user_id, user in users.items():
+        errors = {}
+        if user_id in cognito_futures:
+            cognito_error = cognito_futures[user_id].result()
+            if cognito_error:
+                errors["cognito"] = cognito_error
+        if user_id in dynamodb_errors:
+            errors["dynamodb"] = dynamodb_errors[user_id]
+        for line_number in user["lines"]:
+            result = {"line": line_number, "user_id": user_id, "status": "failed" if errors else "updated"}
+            if errors:
+                result["errors"] = errors
+            results[line_number] = result
+
+    if users:
+        profile_cache.invalidate_profiles(list(users))
+    return [results[line_number] for line_number in sorted(results)]
+
+
+# ✅ Function to stream (end_offset, line) pairs from an S3 body that starts at a byte offset
+def iter_lines(body, offset):
+    pending = b""
+    for chunk in body.iter_chunks(READ_CHUNK_BYTES):
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            offset += len(line) + 1
+            yield offset, line
+    if pending:
+        yield offset + len(pending), pending
+
+
+# ✅ Checkpoint and report helpers
+def job_key(job_id, name):
+    return f"{BULK_UPDATE_PREFIX}/{job_id}/{name}"
+
+
+def load_checkpoint(job_id):
+    try:
+        response = s3_client.get_object(Bucket=BULK_UPDATE_BUCKET, Key=job_key(job_id, "checkpoint.json"))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(response["Body"].read())
+
+
+def save_checkpoint(checkpoint):
+    s3_client.put_object(
+        Bucket=BULK_UPDATE_BUCKET,
+        Key=job_key(checkpoint["job_id"], "checkpoint.json"),
+        Body=json.dumps(checkpoint).encode("utf-8"),
+        ContentType="application/json"
+    )
+
+
+def write_report_part(checkpoint, results):
+    """ ✅ One report object per checkpoint (S3 cannot append); parts sort in file order """
+    part = checkpoint["report_parts"]
+    s3_client.put_object(
+        Bucket=BULK_UPDATE_BUCKET,
+        Key=job_key(checkpoint["job_id"], f"report-{part:05d}.jsonl"),
+        Body="".join(json.dumps(result) + "\n" for result in results).encode("utf-8"),
+        ContentType="application/x-ndjson"
+    )
+    checkpoint["report_parts"] = part + 1
+
+
+def summarize(checkpoint):
+    return {
+        "job_id": checkpoint["job_id"],
+        "status": checkpoint["status"],
+        "lines": checkpoint["line"],
+        "updated": checkpoint["updated"],
+        "failed": checkpoint["failed"],
+        "report": f"s3://{BULK_UPDATE_BUCKET}/{job_key(checkpoint['job_id'], '')}"
+    }
+
+
+def out_of_time(context):
+    return context is not None and context.get_remaining_time_in_millis() < STOP_MARGIN_MS
+
+
+# ✅ Function to run (or resume) a bulk job until the file ends or the invocation runs low on time
+def run_bulk_update(bucket, key, job_id, context):
+    """ Re-invoke with the same source (or job_id) to resume; lines after the last checkpoint may be
+    applied twice, which is safe because every update sets absolute values """
+    checkpoint = load_checkpoint(job_id) or {
+        "job_id": job_id,
+        "source": {"bucket": bucket, "key": key},
+        "status": "running",
+        "etag": None,
+        "size": None,
+        "offset": 0,
+        "line": 0,
+        "updated": 0,
+        "failed": 0,
+        "report_parts": 0
+    }
+    if checkpoint["status"] == "complete":
+        return checkpoint
+
+    if checkpoint["size"] is None or checkpoint["offset"] < checkpoint["size"]:
+        request = {"Bucket": bucket, "Key": key}
+        if checkpoint["offset"]:
+            request["Range"] = f"bytes={checkpoint['offset']}-"
+        if checkpoint["etag"]:
+            request["IfMatch"] = checkpoint["etag"]  # Fail rather than resume into a different file
+        response = s3_client.get_object(**request)
+        if checkpoint["etag"] is None:
+            checkpoint["etag"], checkpoint["size"] = response["ETag"], response["ContentLength"]
+
+        pending_results, batch = [], []
+        line_number = checkpoint["line"]
+
+        def apply_batch(offset):
+            results = process_batch(batch)
+            batch.clear()
+            pending_results.extend(results)
+            for result in results:
+                checkpoint[result["status"]] += 1
+            checkpoint["offset"], checkpoint["line"] = offset, line_number
+
+        def commit():
+            if pending_results:
+                write_report_part(checkpoint, pending_results)
+                pending_results.clear()
+            save_checkpoint(checkpoint)
+
+        offset = checkpoint["offset"]
+        for offset, raw in iter_lines(response["Body"], checkpoint["offset"]):
+            line_number += 1
+            if raw.strip():
+                batch.append((line_number, raw))
+            if len(batch) < BATCH_RECORDS:
+                continue
+            apply_batch(offset)
+            if out_of_time(context):
+                response["Body"].close()
+                commit()
+                return checkpoint
+            if len(pending_results) >= CHECKPOINT_EVERY_RECORDS:
+                commit()
+        apply_batch(offset)
+        if pending_results:
+            write_report_part(checkpoint, pending_results)
+
+    checkpoint["status"] = "complete"
+    save_checkpoint(checkpoint)
+    return checkpoint
+
+
+# ✅ Direct-invocation entry point (routed from dynamodb_handler.lambda_handler)
+def handle_bulk_update(event, context):
+    source = event.get("source") or {}
+    bucket, key = source.get("bucket"), source.get("key")
+    if not bucket or not key:
+        return {"statusCode": 400, "body": json.dumps({"error": "Missing source bucket or key"})}
+    job_id = event.get("job_id") or hashlib.sha256(f"{bucket}/{key}".encode("utf-8")).hexdigest()[:16]
+    try:
+        checkpoint = run_bulk_update(bucket, key, job_id, context)
+        logger.info("Bulk update %s: %s", job_id, json.dumps(summarize(checkpoint)))
+        return {"statusCode": 200, "body": json.dumps(summarize(checkpoint))}
+    except Exception as e:
+        logger.error("Bulk update %s failed: %s", job_id, e)
+        return {"statusCode": 500, "body": json.dumps({"error": "Bulk update failed", "job_id": job_id})}
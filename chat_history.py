@@ -0,0 +1,92 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from aws_clients import lazy_table
+
+# ✅ Table Layout (Placeholders for Security)
+# PK: TS_user_id, SK: message_ts ("<UTC timestamp>#<suffix>", sorts chronologically)
+CHAT_HISTORY_TABLE_NAME = os.getenv("CHAT_HISTORY_TABLE_NAME", "<DYNAMODB_CHAT_HISTORY_TABLE>")
+LEGACY_MESSAGE_TS = "1970-01-01T00:00:00.000000Z"  # Migrated legacy messages sort before every real message
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+history_table = lazy_table(CHAT_HISTORY_TABLE_NAME)
+
+
+# ✅ Function to format a timestamp as a sort-key prefix (also used as a session start marker)
+def format_timestamp(now=None):
+    now = now or datetime.now(timezone.utc)
+    return now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+# ✅ Function to build a time-ordered sort key
+def make_sort_key(now=None):
+    return f"{format_timestamp(now)}#{uuid.uuid4().hex[:8]}"
+
+
+# ✅ Function to build one history item (also used inside transactional writes)
+def build_message_item(user_id, message, role="user", now=None):
+    return {
+        "TS_user_id": user_id,
+        "message_ts": make_sort_key(now),
+        "role": role,
+        "message": message
+    }
+
+
+# ✅ Function to append one message to a user's history
+def append_message(user_id, message, role="user"):
+    item = build_message_item(user_id, message, role)
+    history_table.put_item(Item=item)
+    return item
+
+
+# ✅ Function to copy a legacy session-item chat_history list into history items
+def migrate_legacy_messages(user_id, messages):
+    """ Keys are fixed per list position, so a retried migration overwrites rather than duplicates """
+    with history_table.batch_writer() as batch:
+        for position, message in enumerate(messages):
+            batch.put_item(Item={
+                "TS_user_id": user_id,
+                "message_ts": f"{LEGACY_MESSAGE_TS}#legacy{position:06d}",
+                "role": "user",
+                "message": message
+            })
+
+
+# ✅ Function to read one page of history, newest first from DynamoDB, returned oldest first
+def get_messages_page(user_id, before=None, limit=DEFAULT_PAGE_SIZE, since=None):
+    """ Returns (messages, next_cursor); pass next_cursor as `before` to load older messages.
+    since (a session start from format_timestamp) hides messages from earlier sessions. """
+    from boto3.dynamodb.conditions import Key  # boto3 is only loaded once a query runs
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    key_condition = Key("TS_user_id").eq(user_id)
+    query_limit = limit
+    if before and since:
+        # ✅ between() is inclusive, so fetch one extra row and drop the cursor row itself
+        key_condition = key_condition & Key("message_ts").between(since, before)
+        query_limit += 1
+    elif before:
+        key_condition = key_condition & Key("message_ts").lt(before)
+    elif since:
+        key_condition = key_condition & Key("message_ts").gt(since)
+
+    response = history_table.query(
+        KeyConditionExpression=key_condition,
+        ProjectionExpression="message_ts, #role, message",
+        ExpressionAttributeNames={"#role": "role"},
+        ScanIndexForward=False,
+        Limit=query_limit
+    )
+    items = [item for item in response.get("Items", []) if item["message_ts"] != before]
+    has_more = "LastEvaluatedKey" in response or len(items) > limit
+    items = items[:limit]
+    next_cursor = items[-1]["message_ts"] if items and has_more else None
+    items.reverse()
+    return items, next_cursor
+
+
+# ✅ Function to read only the last N messages
+def get_recent_messages(user_id, limit=DEFAULT_PAGE_SIZE, since=None):
+    messages, _ = get_messages_page(user_id, limit=limit, since=since)
+    return messages
@@ -1,22 +1,54 @@
+import os
 import json
-import boto3
-import requests
+import time
+import queue
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+import chat_history
+import response_cache
+import connection_registry
+from make_client import make_client
+from aws_clients import get_client, lazy_client, lazy_table
+from instrumentation import instrument, record_error, submit, context_map
 
-# ✅ Initialize AWS Clients
-dynamodb = boto3.resource("dynamodb")
-secrets_manager = boto3.client("secretsmanager")
+# Setup Logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# ✅ AWS Clients (created on first use)
+secrets_manager = lazy_client("secretsmanager")
 
 # ✅ Table and Secrets (Placeholders for Security)
-TABLE_NAME = "<DYNAMODB_TABLE_NAME>"
-SECRET_ARN = "<SECRETS_MANAGER_ARN>"
+TABLE_NAME = os.getenv("DYNAMODB_TABLE_NAME", "<DYNAMODB_TABLE_NAME>")
+SECRET_ARN = os.getenv("SECRETS_MANAGER_ARN", "<SECRETS_MANAGER_ARN>")
 
-table = dynamodb.Table(TABLE_NAME)
+table = lazy_table(TABLE_NAME)
 cached_webhook_url = None  # ✅ Cache to reduce Secrets Manager calls
 
-# ✅ Function to initialize WebSocket API Client
+# ✅ WebSocket fan-out settings
+BROADCAST_MAX_WORKERS = 8
+
+# ✅ Message pipeline: overlap DynamoDB persistence with the Make.com call
+PIPELINED_MESSAGES = os.getenv("PIPELINED_MESSAGES", "true").lower() == "true"
+pipeline_executor = ThreadPoolExecutor(max_workers=2)
+
+# ✅ Context retrieval: send only relevant past messages plus the last few turns to Make.com
+CONTEXT_RETRIEVAL = os.getenv("CONTEXT_RETRIEVAL", "true").lower() == "true"
+CONTEXT_TOP_K = 4
+CONTEXT_RECENT_TURNS = 4
+
+# ✅ Streaming replies: relay Make.com output to the WebSocket as it arrives
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() == "true"
+STREAM_MIN_FRAME_CHARS = 40  # Coalesce tiny chunks into fewer post_to_connection calls
+STREAM_MAX_FRAME_DELAY = 0.15  # ...but never hold text back longer than this (seconds), even mid-stall
+
+# ✅ Function to initialize WebSocket API Client (one per (domain, stage), reused across warm invocations)
 def get_apigw_client(domain_name, stage):
-    return boto3.client(
+    return get_client(
         "apigatewaymanagementapi",
         endpoint_url=f"https://{domain_name}/{stage}"
     )
@@ -42,24 +74,120 @@ def get_webhook_url():
 def send_to_make(event_data):
     make_url = get_webhook_url()
     if not make_url:
-        return {"response": "Error: Missing Webhook URL"}
+        return make_client.error_response("Error: Missing Webhook URL")
     
+    return make_client.post(make_url, event_data)
+
+# ✅ Posts raw data to one connection; returns "sent", "gone" or "error"
+def post_to_connection(client, connection_id, data):
     try:
-        response = requests.post(make_url, json=event_data, timeout=10)
-        response.raise_for_status()
-        return response.json() if response.content else {"response": "Success"}
-    except requests.exceptions.RequestException:
-        return {"response": "Request Error to Make.com"}
+        client.post_to_connection(ConnectionId=connection_id, Data=data)
+        return "sent"
+    except client.exceptions.GoneException:
+        return "gone"
+    except Exception as e:
+        logger.warning("post_to_connection failed for %s: %s", connection_id, e)
+        return "error"
 
 # ✅ Function to send messages via WebSocket
 def send_to_websocket(domain, stage, connection_id, message):
-    try:
-        client = get_apigw_client(domain, stage)
-        client.post_to_connection(ConnectionId=connection_id, Data=json.dumps({"response": message}))
-    except Exception:
-        pass
+    client = get_apigw_client(domain, stage)
+    return post_to_connection(client, connection_id, json.dumps({"response": message}))
+
+# ✅ Function to send one payload to many connections in parallel
+def broadcast_to_websockets(domain, stage, connection_ids, message):
+    """ Returns {"sent": [...], "gone": [...], "failed": [...]} so callers can prune gone connections """
+    client = get_apigw_client(domain, stage)
+    data = json.dumps({"response": message})
+    connection_ids = list(dict.fromkeys(connection_ids))
+    results = {"sent": [], "gone": [], "failed": []}
+    if not connection_ids:
+        return results
+
+    workers = min(BROADCAST_MAX_WORKERS, len(connection_ids))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statuses = context_map(executor, lambda cid: post_to_connection(client, cid, data), connection_ids)
+        for connection_id, status in zip(connection_ids, statuses):
+            bucket = {"sent": "sent", "gone": "gone"}.get(status, "failed")
+            results[bucket].append(connection_id)
+    return results
+
+# ✅ Function to stream text chunks to a connection as numbered frames, ending with a "done" (or "error") frame
+# ✅ Returns (text, complete); complete is False if the stream failed or the client went away
+def relay_stream_to_websocket(domain, stage, connection_id, chunks, timings=None):
+    client = get_apigw_client(domain, stage)
+    stream_started = time.perf_counter()
+    parts = []
+    pending = []
+    pending_since = None
+    seq = 0
+
+    def flush():
+        nonlocal seq, pending, pending_since
+        frame = {"type": "chunk", "seq": seq, "response": "".join(pending)}
+        status = post_to_connection(client, connection_id, json.dumps(frame))
+        if seq == 0 and timings is not None:
+            timings["first_chunk"] = round((time.perf_counter() - stream_started) * 1000, 2)
+        seq += 1
+        pending, pending_since = [], None
+        return status
+
+    # ✅ Chunks are read on a separate thread so held-back text is flushed even while Make.com stalls
+    chunk_queue = queue.Queue()
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if stopped.is_set():
+                    break
+                chunk_queue.put(("chunk", chunk))
+            chunk_queue.put(("end", None))
+        except Exception as e:
+            chunk_queue.put(("error", e))
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()  # ✅ Releases the Make.com connection if the client went away mid-stream
+
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
+
+    status = "sent"
+    error = None
+    while status != "gone":
+        timeout = None
+        if pending:
+            timeout = max(0.0, STREAM_MAX_FRAME_DELAY - (time.perf_counter() - pending_since))
+        try:
+            kind, value = chunk_queue.get(timeout=timeout)
+        except queue.Empty:
+            status = flush()
+            continue
+        if kind == "end":
+            break
+        if kind == "error":
+            error = value
+            break
+        parts.append(value)
+        pending.append(value)
+        pending_since = pending_since or time.perf_counter()
+        pending_chars = sum(len(p) for p in pending)
+        # ✅ First frame goes out immediately to minimise time-to-first-token
+        if seq == 0 or pending_chars >= STREAM_MIN_FRAME_CHARS:
+            status = flush()
+    stopped.set()
+    if pending and status != "gone":
+        status = flush()
+    if error is not None:
+        logger.warning("Reply stream to %s failed after %d frames: %s", connection_id, seq, error)
+        record_error(error)
+        if status != "gone":
+            post_to_connection(client, connection_id, json.dumps({"type": "error", "seq": seq, "error": "Reply interrupted"}))
+    elif status != "gone":
+        post_to_connection(client, connection_id, json.dumps({"type": "done", "seq": seq}))
+    return "".join(parts), error is None and status != "gone"
 
 # ✅ Main WebSocket Lambda Handler
+@instrument
 def lambda_handler(event, context):
     route_key = event.get("requestContext", {}).get("routeKey", "")
     
@@ -69,16 +197,74 @@ def lambda_handler(event, context):
         return handle_disconnect(event)
     elif route_key == "sendMessage":
         return handle_message(event)
+    elif route_key == "getHistory":
+        return handle_get_history(event)
+    elif not route_key and event.get("action") == "push":
+        return handle_push(event)
     
     return {"statusCode": 400, "body": "Invalid action"}
 
+# ✅ Resolve the user for a connection from the authorizer only (never from client-supplied fields)
+def get_authorized_user_id(event):
+    authorizer = event.get("requestContext", {}).get("authorizer") or {}
+    return authorizer.get("principalId")
+
+# ✅ Resolve the user behind an already-open connection (authorizer, then the connection registry)
+def get_connection_user_id(event):
+    return get_authorized_user_id(event) or connection_registry.get_connection_user(event["requestContext"]["connectionId"])
+
 # ✅ WebSocket Connection Handlers
 def handle_connect(event):
+    request_context = event["requestContext"]
+    user_id = get_authorized_user_id(event)
+    if not user_id:
+        # ✅ Without a $connect authorizer the connection has no user, so sendMessage/getHistory will return 403
+        logger.error("No authorizer principalId on $connect for %s; is the WebSocket Lambda authorizer configured?",
+                     request_context["connectionId"])
+        return {"statusCode": 200, "body": "Connected"}
+    try:
+        connection_registry.register_connection(
+            user_id, request_context["connectionId"], request_context["domainName"], request_context["stage"]
+        )
+    except Exception as e:
+        logger.warning("Failed to register connection: %s", e)
     return {"statusCode": 200, "body": "Connected"}
 
 def handle_disconnect(event):
+    try:
+        connection_registry.unregister_connection(event["requestContext"]["connectionId"])
+    except Exception as e:
+        logger.warning("Failed to unregister connection: %s", e)
     return {"statusCode": 200, "body": "Disconnected"}
 
+# ✅ Pushes a message to every open connection of a user (e.g. Make.com automation results)
+def push_to_user(user_id, message):
+    endpoints = {}
+    for connection in connection_registry.get_user_connections(user_id):
+        endpoint = (connection["domainName"], connection["stage"])
+        endpoints.setdefault(endpoint, []).append(connection["connectionId"])
+
+    delivered = 0
+    for (domain, stage), connection_ids in endpoints.items():
+        results = broadcast_to_websockets(domain, stage, connection_ids, message)
+        delivered += len(results["sent"])
+        if results["gone"]:
+            connection_registry.remove_connections(user_id, results["gone"])
+    return delivered
+
+# ✅ Direct-invocation handler used by automations: {"action": "push", "user_id": ..., "message": ...}
+def handle_push(event):
+    user_id = event.get("user_id")
+    message = event.get("message")
+    if not user_id or message is None:
+        return {"statusCode": 400, "body": "Missing user_id or message"}
+    try:
+        delivered = push_to_user(user_id, message)
+        return {"statusCode": 200, "body": json.dumps({"delivered": delivered})}
+    except Exception as e:
+        record_error(e)
+        return {"statusCode": 500, "body": "Internal Server Error"}
+
 # ✅ Handles Incoming WebSocket Messages
 def handle_message(event):
     connection_id = event["requestContext"]["connectionId"]
@@ -87,60 +273,328 @@ def handle_message(event):
     
     try:
         event_body = json.loads(event.get("body", "{}"))
-        user_id = event_body.get("user_id")
         message = event_body.get("message")
         
-        if not user_id or not message:
-            return {"statusCode": 400, "body": "Missing user_id or message"}
+        if not message:
+            return {"statusCode": 400, "body": "Missing message"}
+        # ✅ The user comes from the connection, never from the body; a mismatching body user_id is rejected
+        user_id = get_connection_user_id(event)
+        if not user_id:
+            return {"statusCode": 403, "body": "Unknown connection"}
+        if event_body.get("user_id") not in (None, user_id):
+            return {"statusCode": 403, "body": "user_id does not match the connection"}
+        event_body = dict(event_body, user_id=user_id)
         
-        session_data = check_or_create_session(user_id, connection_id)
-        update_chat_history(user_id, message)
-        make_response = send_to_make(event_body)
-        response_message = make_response.get("response", "No response from Make.com")
-        send_to_websocket(domain_name, stage, connection_id, response_message)
+        timings = {}
+        started = time.perf_counter()
+        # ✅ Retrieval runs first so the index append below never sees the current message
+        payload = timed_stage(timings, "context", with_context, user_id, message, event_body)
+        if PIPELINED_MESSAGES:
+            # ✅ Persistence runs alongside Make.com; the reply goes out as soon as Make answers
+            persist_future = submit(
+                pipeline_executor, persist_message, timings, user_id, connection_id, message
+            )
+            reply = reply_to_message(timings, domain_name, stage, connection_id, payload)
+            try:
+                session_data = persist_future.result()  # ✅ Finish writes before the container is frozen
+            except Exception as e:
+                # ✅ The reply is already out, so a 500 would only hide it; log the unsaved turn instead
+                logger.error("Failed to persist message for %s after replying: %s", user_id, e)
+                record_error(e)
+                session_data = None
+        else:
+            session_data = persist_message(timings, user_id, connection_id, message)
+            reply = reply_to_message(timings, domain_name, stage, connection_id, payload)
+        if session_data is not None:
+            persist_reply(timings, user_id, reply, session_data)
+        log_message_timings(timings, started)
         
         return {"statusCode": 200, "body": "Message processed successfully"}
-    except Exception:
+    except Exception as e:
+        record_error(e)
         return {"statusCode": 500, "body": "Internal Server Error"}
 
-# ✅ Session Handling (DynamoDB)
-def check_or_create_session(user_id, connection_id):
+# ✅ Runs fn and records its duration (ms) under timings[stage]
+def timed_stage(timings, stage, fn, *args):
+    stage_started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[stage] = round((time.perf_counter() - stage_started) * 1000, 2)
+
+# ✅ Message pipeline stages
+def history_bootstrap(user_id, since):
+    return lambda: chat_history.get_recent_messages(user_id, chat_history.MAX_PAGE_SIZE, since=since)
+
+def history_after(user_id):
+    return lambda after: chat_history.get_recent_messages(user_id, chat_history.MAX_PAGE_SIZE, since=after)
+
+def with_context(user_id, message, event_body):
+    # ✅ Allowlisted FAQs go to Make.com without conversation context, so their replies stay cacheable
+    if not CONTEXT_RETRIEVAL or response_cache.is_cacheable(event_body):
+        return event_body
+    try:
+        import context_index  # numpy is only loaded once retrieval runs, not on every cold start
+        since = get_session_started(user_id)
+        context = context_index.build_context(
+            user_id, message, k=CONTEXT_TOP_K, recent_turns=CONTEXT_RECENT_TURNS,
+            bootstrap=history_bootstrap(user_id, since), since=since, fetch_newer=history_after(user_id)
+        )
+        return dict(event_body, context=context)
+    except Exception as e:
+        logger.warning("Context retrieval failed: %s", e)
+        return event_body
+
+def index_message(user_id, history_item, session_data):
+    since = session_data.get("session_started")
+    try:
+        import context_index  # numpy is only loaded once retrieval runs, not on every cold start
+        context_index.add_message(
+            user_id, history_item["message"], history_item["role"], history_item["message_ts"],
+            bootstrap=history_bootstrap(user_id, since), since=since
+        )
+    except Exception as e:
+        logger.warning("Failed to index chat message: %s", e)
+
+def persist_message(timings, user_id, connection_id, message):
     now = datetime.now(timezone.utc)
-    expiration_time = now - timedelta(days=7)
-    
-    response = table.get_item(Key={"TS_user_id": user_id})
-    session_data = response.get("Item")
-    
-    if session_data:
-        last_active = session_data.get("last_active")
-        if last_active and datetime.fromisoformat(last_active) > expiration_time:
-            table.update_item(
-                Key={"TS_user_id": user_id},
-                UpdateExpression="SET last_active = :now",
-                ExpressionAttributeValues={":now": now.isoformat()}
-            )
-            return session_data
-    
-    new_session = {
-        "TS_user_id": user_id,
-        "connectionId": connection_id,
-        "last_active": now.isoformat(),
-        "chat_history": []
-    }
-    table.put_item(Item=new_session)
-    return new_session
-
-# ✅ Update Chat History
-def update_chat_history(user_id, message):
+    history_item = chat_history.build_message_item(user_id, message, now=now)
+    session_data = timed_stage(timings, "session_and_history", record_message, user_id, connection_id, history_item, now)
+    if CONTEXT_RETRIEVAL:
+        timed_stage(timings, "context_index", index_message, user_id, history_item, session_data)
+    return session_data
+
+# ✅ Stores the assistant's reply as its own turn so later context retrieval can find it
+def persist_reply(timings, user_id, reply, session_data):
+    if not isinstance(reply, str) or not reply:
+        return
+    try:
+        history_item = timed_stage(timings, "reply_history", chat_history.append_message, user_id, reply, "assistant")
+    except Exception as e:
+        logger.warning("Failed to store assistant reply for %s: %s", user_id, e)
+        return
+    if CONTEXT_RETRIEVAL:
+        timed_stage(timings, "reply_context_index", index_message, user_id, history_item, session_data or {})
+
+# ✅ Accepts JSON booleans and "true"/"false"-style strings from clients
+def parse_flag(value, default=False):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "on")
+    return bool(value)
+
+def reply_to_message(timings, domain_name, stage, connection_id, event_body):
+    streaming = parse_flag(event_body.get("stream"), STREAM_REPLIES)
+
+    # ✅ Repeated plain questions are answered from the response cache without calling Make.com
+    cache_key = None
+    if response_cache.is_cacheable(event_body):
+        cache_key = response_cache.cache_key_for(event_body)
+        cached_reply = timed_stage(timings, "response_cache", response_cache.get_response, cache_key)
+        if cached_reply is not None:
+            if streaming:
+                return relay_stream_to_websocket(domain_name, stage, connection_id, iter([cached_reply]), timings)[0]
+            timed_stage(timings, "websocket_reply", send_to_websocket, domain_name, stage, connection_id, cached_reply)
+            return cached_reply
+    else:
+        response_cache.record_bypass()
+
+    if streaming:
+        response_message, complete = timed_stage(
+            timings, "make_stream", stream_reply, timings, domain_name, stage, connection_id, event_body
+        )
+    else:
+        make_response = timed_stage(timings, "make", send_to_make, event_body)
+        response_message = make_response.get("response", "No response from Make.com")
+        timed_stage(timings, "websocket_reply", send_to_websocket, domain_name, stage, connection_id, response_message)
+        if not is_make_reply(make_response):
+            return None
+        complete = True
+    # ✅ Only a fully delivered Make.com reply is cached; a partial stream is still kept as a turn
+    if cache_key and complete and response_message:
+        timed_stage(timings, "response_cache_store", response_cache.put_response, cache_key, response_message)
+    return response_message
+
+# ✅ Busy/fallback and placeholder/error replies are shown to the user but are not part of the conversation
+def is_make_reply(make_response):
+    if make_response.get("fallback") or make_response.get("error"):
+        return False
+    return isinstance(make_response.get("response"), str)
+
+# ✅ Returns (reply, complete); reply is None when Make.com did not produce one
+def stream_reply(timings, domain_name, stage, connection_id, event_body):
+    make_url = get_webhook_url()
+    if not make_url:
+        chunks, make_response = None, make_client.error_response("Error: Missing Webhook URL")
+    else:
+        chunks, make_response = make_client.open_stream(make_url, event_body)
+    if make_response:
+        response_message = make_response.get("response", "No response from Make.com")
+        reply, complete = relay_stream_to_websocket(domain_name, stage, connection_id, iter([response_message]), timings)
+        return (reply, complete) if is_make_reply(make_response) else (None, False)
+    return relay_stream_to_websocket(domain_name, stage, connection_id, chunks, timings)
+
+# ✅ One structured log line per message; saved_ms is the overlap gained versus running stages in sequence
+def log_message_timings(timings, started):
+    total_ms = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(json.dumps({
+        "event": "message_timings",
+        "pipelined": PIPELINED_MESSAGES,
+        "stages_ms": timings,
+        "total_ms": total_ms,
+        "saved_ms": round(max(sum(v for k, v in timings.items() if k != "first_chunk") - total_ms, 0), 2),
+        "make_client": make_client.get_stats(),
+        "response_cache": response_cache.get_stats()
+    }))
+
+# ✅ Handles History Requests: {"before": <cursor>, "limit": N} for the user that owns the connection
+def handle_get_history(event):
+    connection_id = event["requestContext"]["connectionId"]
+    domain_name = event["requestContext"]["domainName"]
+    stage = event["requestContext"]["stage"]
+
+    try:
+        event_body = json.loads(event.get("body") or "{}")
+        user_id = get_connection_user_id(event)
+        if not user_id:
+            return {"statusCode": 403, "body": "Unknown connection"}
+
+        messages, next_cursor = chat_history.get_messages_page(
+            user_id,
+            before=event_body.get("before"),
+            limit=event_body.get("limit", chat_history.DEFAULT_PAGE_SIZE),
+            since=get_session_started(user_id)
+        )
+        client = get_apigw_client(domain_name, stage)
+        post_to_connection(client, connection_id, json.dumps({"history": messages, "next_cursor": next_cursor}))
+        return {"statusCode": 200, "body": "History sent"}
+    except Exception as e:
+        record_error(e)
+        return {"statusCode": 500, "body": "Internal Server Error"}
+
+# ✅ Session Read (projection keeps legacy chat_history lists off the wire)
+SESSION_PROJECTION = "TS_user_id, connectionId, last_active, session_started"
+SESSION_EXPIRY = timedelta(days=7)
+SESSION_CACHE_TTL_SECONDS = 60
+SESSION_CACHE_MAX_USERS = 1024
+LEGACY_SESSION_START = "0"  # Sorts before every message_ts: sessions created before session_started existed
+
+# ✅ Recent session state per user (LRU), reused across warm invocations
+session_cache = OrderedDict()
+session_cache_lock = threading.Lock()
+
+def cache_session(user_id, session_data):
+    with session_cache_lock:
+        session_cache[user_id] = (session_data, time.monotonic())
+        session_cache.move_to_end(user_id)
+        while len(session_cache) > SESSION_CACHE_MAX_USERS:
+            session_cache.popitem(last=False)
+
+def get_cached_session(user_id, connection_id=None):
+    with session_cache_lock:
+        entry = session_cache.get(user_id)
+        if not entry:
+            return None
+        session_data, cached_at = entry
+        if time.monotonic() - cached_at > SESSION_CACHE_TTL_SECONDS:
+            session_cache.pop(user_id, None)
+            return None
+        if connection_id and session_data.get("connectionId") != connection_id:
+            return None
+        session_cache.move_to_end(user_id)
+        return session_data
+
+# ✅ Function to find where the user's current session starts; history before it belongs to expired sessions
+def get_session_started(user_id):
+    """ Returns a chat_history timestamp; if the session has expired, "now" (the next message starts a new one) """
+    session_data = get_cached_session(user_id)
+    if session_data and session_data.get("session_started"):
+        return session_data["session_started"]
+
+    now = datetime.now(timezone.utc)
+    item = table.get_item(Key={"TS_user_id": user_id}, ProjectionExpression=SESSION_PROJECTION).get("Item")
+    if not item or item.get("last_active", "") <= (now - SESSION_EXPIRY).isoformat():
+        return chat_history.format_timestamp(now)
+    session_started = item.get("session_started")
+    if not session_started:
+        migrate_legacy_history(user_id)
+        session_started = LEGACY_SESSION_START
+    # ✅ Cache what was read so the rest of a burst skips this GetItem (last_active is still touched once)
+    cache_session(user_id, dict(session_data or item, session_started=session_started))
+    return session_started
+
+# ✅ Moves an active legacy session's chat_history list into the history table, then drops the list
+def migrate_legacy_history(user_id):
+    item = table.get_item(Key={"TS_user_id": user_id}, ProjectionExpression="chat_history").get("Item") or {}
+    messages = item.get("chat_history") or []
+    if messages:
+        chat_history.migrate_legacy_messages(user_id, messages)
     try:
+        # ✅ Only remove the list that was copied; if it grew meanwhile, the next read migrates it again
         table.update_item(
             Key={"TS_user_id": user_id},
-            UpdateExpression="SET chat_history = list_append(if_not_exists(chat_history, :empty_list), :new_message)",
-            ExpressionAttributeValues={
-                ":empty_list": [],
-                ":new_message": [message]
-            },
-            ConditionExpression="attribute_exists(TS_user_id)"
+            UpdateExpression="SET session_started = :legacy REMOVE chat_history",
+            ConditionExpression="attribute_not_exists(session_started) AND "
+                                "(attribute_not_exists(chat_history) OR size(chat_history) = :count)",
+            ExpressionAttributeValues={":legacy": LEGACY_SESSION_START, ":count": len(messages)}
         )
-    except Exception:
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
         pass
+
+# ✅ Session Handling (DynamoDB): touch or reset the session and append the message in one request
+def record_message(user_id, connection_id, history_item, now):
+    cached_session = get_cached_session(user_id)
+    client = table.meta.client
+
+    # ✅ Burst from a known-active session whose last_active was just written: only the message needs writing
+    recently_touched = (now - timedelta(seconds=SESSION_CACHE_TTL_SECONDS)).isoformat()
+    if (cached_session and cached_session.get("connectionId") == connection_id
+            and cached_session.get("last_active", "") >= recently_touched):
+        client.put_item(TableName=chat_history.CHAT_HISTORY_TABLE_NAME, Item=history_item)
+        return cached_session
+
+    session_data = {"TS_user_id": user_id, "connectionId": connection_id, "last_active": now.isoformat()}
+    history_put = {"Put": {"TableName": chat_history.CHAT_HISTORY_TABLE_NAME, "Item": history_item}}
+    try:
+        client.transact_write_items(TransactItems=[
+            {"Update": {
+                "TableName": TABLE_NAME,
+                "Key": {"TS_user_id": user_id},
+                # ✅ session_started is left unset on legacy items; get_session_started migrates their chat_history
+                "UpdateExpression": "SET last_active = :now, connectionId = :cid",
+                "ConditionExpression": "last_active > :expiry",
+                "ExpressionAttributeValues": {
+                    ":now": now.isoformat(),
+                    ":cid": connection_id,
+                    ":expiry": (now - SESSION_EXPIRY).isoformat()
+                }
+            }},
+            history_put
+        ])
+        # ✅ Still the same session, so keep the session_started already known from the cache
+        if cached_session and cached_session.get("session_started"):
+            session_data["session_started"] = cached_session["session_started"]
+    except client.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get("CancellationReasons", [])
+        if not reasons or reasons[0].get("Code") != "ConditionalCheckFailed":
+            raise
+        # ✅ Missing or expired session: start a fresh one; history reads skip everything before session_started
+        # An update rather than a put, so an expired legacy chat_history list is kept, not overwritten
+        session_data["session_started"] = chat_history.format_timestamp(now)
+        client.transact_write_items(TransactItems=[
+            {"Update": {
+                "TableName": TABLE_NAME,
+                "Key": {"TS_user_id": user_id},
+                "UpdateExpression": "SET last_active = :now, connectionId = :cid, session_started = :started",
+                "ExpressionAttributeValues": {
+                    ":now": now.isoformat(),
+                    ":cid": connection_id,
+                    ":started": session_data["session_started"]
+                }
+            }},
+            history_put
+        ])
+
+    cache_session(user_id, session_data)
+    return session_data
@@ -0,0 +1,66 @@
+import os
+import time
+from aws_clients import lazy_table
+
+# ✅ Table Layout (Placeholders for Security)
+# PK: TS_user_id, SK: connectionId, GSI "connectionId-index" on connectionId, TTL attribute expires_at
+CONNECTIONS_TABLE_NAME = os.getenv("CONNECTIONS_TABLE_NAME", "<DYNAMODB_CONNECTIONS_TABLE>")
+CONNECTION_INDEX_NAME = os.getenv("CONNECTION_INDEX_NAME", "connectionId-index")
+CONNECTION_TTL_SECONDS = 2 * 60 * 60  # API Gateway closes WebSockets after 2 hours
+
+connections_table = lazy_table(CONNECTIONS_TABLE_NAME)
+
+# ✅ Function to register (or refresh) a user's connection
+def register_connection(user_id, connection_id, domain_name, stage):
+    now = int(time.time())
+    connections_table.put_item(Item={
+        "TS_user_id": user_id,
+        "connectionId": connection_id,
+        "domainName": domain_name,
+        "stage": stage,
+        "connected_at": now,
+        "expires_at": now + CONNECTION_TTL_SECONDS
+    })
+
+
+# ✅ Function to look up the user that owns a connection (GSI)
+def get_connection_user(connection_id):
+    from boto3.dynamodb.conditions import Key  # boto3 is only loaded once a query runs
+    response = connections_table.query(
+        IndexName=CONNECTION_INDEX_NAME,
+        KeyConditionExpression=Key("connectionId").eq(connection_id),
+        Limit=1
+    )
+    items = response.get("Items", [])
+    return items[0]["TS_user_id"] if items else None
+
+
+# ✅ Function to list a user's open connections (TTL deletes can lag, so filter expired ones)
+def get_user_connections(user_id):
+    from boto3.dynamodb.conditions import Key, Attr
+    kwargs = {
+        "KeyConditionExpression": Key("TS_user_id").eq(user_id),
+        "FilterExpression": Attr("expires_at").gt(int(time.time()))
+    }
+    connections = []
+    while True:
+        response = connections_table.query(**kwargs)
+        connections.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return connections
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+# ✅ Function to remove a connection on $disconnect; returns its user_id
+def unregister_connection(connection_id):
+    user_id = get_connection_user(connection_id)
+    if user_id:
+        remove_connections(user_id, [connection_id])
+    return user_id
+
+
+# ✅ Function to prune connections (e.g. ones that returned GoneException)
+def remove_connections(user_id, connection_ids):
+    with connections_table.batch_writer() as batch:
+        for connection_id in connection_ids:
+            batch.delete_item(Key={"TS_user_id": user_id, "connectionId": connection_id})
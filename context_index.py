@@ -0,0 +1,292 @@
+import os
+import re
+import json
+import time
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from aws_clients import lazy_client
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ S3 Client (created on first use)
+s3_client = lazy_client("s3")
+
+# ✅ Index Settings (Placeholders for Security)
+CONTEXT_INDEX_DIR = os.getenv("CONTEXT_INDEX_DIR", "/tmp/context_index")
+CONTEXT_INDEX_BUCKET = os.getenv("CONTEXT_INDEX_BUCKET", "")  # Optional S3 copy shared across containers
+CONTEXT_INDEX_PREFIX = "ContextIndex"
+CONTEXT_INDEX_UPLOAD_SECONDS = 300  # Refresh the S3 copy at most this often per user (catch_up fills the gap)
+EMBEDDING_DIM = 256
+MAX_VECTORS_PER_USER = 5000
+COMPACT_TO_FRACTION = 0.8  # On hitting the cap, keep the newest 80% so compaction runs once per ~1000 messages
+MAX_OPEN_INDEXES = 32  # Also bounds /tmp: an evicted index deletes its files
+MIN_SIMILARITY = 0.1
+DEFAULT_TOP_K = 4
+DEFAULT_RECENT_TURNS = 4
+
+# ✅ Binary vector file: 16-byte header, then count x dim little-endian float32 rows.
+# Message texts live next to it in a JSON-lines file, one line per row.
+# The S3 copy is both files concatenated into one object, so the pair is always replaced together.
+INDEX_MAGIC = b"TSCI"
+INDEX_VERSION = 1
+HEADER_FORMAT = "<4sHHII"  # magic, version, reserved, dim, count
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+# ✅ Deterministic local embedder (feature hashing of unigrams and bigrams, no network)
+def embed_text(text, dim=EMBEDDING_DIM):
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    vector = np.sign(vector) * np.log1p(np.abs(vector))  # dampen repeated terms
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class UserContextIndex:
+    """ ✅ One user's message embeddings, memory-mapped from a versioned binary file """
+
+    def __init__(self, user_id, directory=CONTEXT_INDEX_DIR, dim=EMBEDDING_DIM):
+        self.user_id = user_id
+        self.dim = dim
+        safe_name = hashlib.sha256(user_id.encode("utf-8")).hexdigest()
+        self.vector_path = os.path.join(directory, f"{safe_name}.vec")
+        self.text_path = os.path.join(directory, f"{safe_name}.jsonl")
+        self.s3_key = f"{CONTEXT_INDEX_PREFIX}/{safe_name}.idx"
+        self.lock = threading.Lock()
+        self.matrix = None
+        self.messages = []
+        self.since = None  # Start of the session the rows belong to (chat_history.format_timestamp)
+        self.known = set()  # message_ts of every row, for de-duplicating catch-up reads
+        self.high_water = None  # Newest message_ts in the index
+        self.loaded = False
+        self.unsaved = False  # Rows added since the last S3 upload
+        self.uploaded_at = None
+        self.closed = False  # Evicted: files deleted, later writes ignored (chat_history still has them)
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def count(self):
+        return len(self.messages)
+
+    def _read_header(self):
+        with open(self.vector_path, "rb") as f:
+            magic, version, _, dim, count = struct.unpack(HEADER_FORMAT, f.read(HEADER_SIZE))
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or dim != self.dim:
+            raise ValueError(f"Unsupported context index format in {self.vector_path}")
+        return count
+
+    def _write_header(self, f, count):
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, 0, self.dim, count))
+
+    def _map(self, count):
+        if count == 0:
+            self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+        else:
+            self.matrix = np.memmap(self.vector_path, dtype="<f4", mode="r", offset=HEADER_SIZE, shape=(count, self.dim))
+
+    def load(self):
+        """ Maps the local files, pulling them from S3 first if this container has none """
+        if not os.path.exists(self.vector_path):
+            self._download()
+        if not os.path.exists(self.vector_path):
+            return False
+        try:
+            count = self._read_header()
+            with open(self.text_path, "r", encoding="utf-8") as f:
+                messages = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            logger.warning("Discarding unreadable context index for %s: %s", self.user_id, e)
+            return False
+        # ✅ A crash between the two appends can leave one extra row; trust the shorter side
+        count = min(count, len(messages))
+        self._set_messages(messages[:count])
+        self._map(count)
+        return True
+
+    def _set_messages(self, messages):
+        self.messages = list(messages)
+        self.known = {m["message_ts"] for m in self.messages if m.get("message_ts")}
+        self.high_water = max(self.known) if self.known else None
+
+    def rebuild(self, messages, vectors=None):
+        """ Rewrites the index from scratch (e.g. from the chat_history table); vectors reuses existing rows """
+        if vectors is None:
+            messages = messages[-MAX_VECTORS_PER_USER:]
+            vectors = np.stack([embed_text(m["message"], self.dim) for m in messages]) if messages else None
+        self.matrix = None  # release the map before truncating the file
+        with open(self.vector_path, "wb") as f:
+            self._write_header(f, len(messages))
+            if vectors is not None:
+                f.write(vectors.astype("<f4").tobytes())
+        with open(self.text_path, "w", encoding="utf-8") as f:
+            for m in messages:
+                f.write(json.dumps(m) + "\n")
+        self._set_messages(messages)
+        self._map(len(messages))
+        self.unsaved = True
+
+    def scope(self, since):
+        """ Drops rows from earlier sessions once the user's session start is known """
+        if not since or since == self.since:
+            return
+        kept = [i for i, m in enumerate(self.messages) if (m.get("message_ts") or "") > since]
+        if len(kept) != self.count:
+            self.rebuild([self.messages[i] for i in kept], np.array(self.matrix[kept]) if kept else None)
+        self.since = since
+
+    def catch_up(self, fetch_newer):
+        """ Adds messages written by other containers (fetch_newer(after) returns them oldest first) """
+        after = max(filter(None, (self.high_water, self.since)), default=None)
+        added = 0
+        for m in fetch_newer(after):
+            added += self.add(m["message"], m.get("role", "user"), m.get("message_ts"))
+        return added
+
+    def compact(self):
+        """ Keeps the newest rows, reusing their stored vectors instead of re-embedding """
+        keep = int(MAX_VECTORS_PER_USER * COMPACT_TO_FRACTION)
+        self.rebuild(self.messages[-keep:], np.array(self.matrix[-keep:]))
+
+    def add(self, message, role="user", message_ts=None):
+        """ Appends one embedded message in place: new row at the end, count patched in the header """
+        if self.closed or (message_ts and message_ts in self.known):
+            return False
+        entry = {"message": message, "role": role, "message_ts": message_ts}
+        if not os.path.exists(self.vector_path):
+            self.rebuild([entry])
+            return True
+        if self.count >= MAX_VECTORS_PER_USER:
+            self.compact()
+        vector = embed_text(message, self.dim).astype("<f4")
+        self.matrix = None  # release the map before growing the file
+        with open(self.vector_path, "r+b") as f:
+            f.seek(HEADER_SIZE + self.count * self.dim * 4)
+            f.write(vector.tobytes())
+            self._write_header(f, self.count + 1)
+        with open(self.text_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.messages.append(entry)
+        self.unsaved = True
+        if message_ts:
+            self.known.add(message_ts)
+            self.high_water = max(self.high_water or message_ts, message_ts)
+        self._map(self.count)
+        return True
+
+    def search(self, query, k=DEFAULT_TOP_K, exclude_last=0):
+        """ Vectorised top-k cosine search over all but the newest exclude_last rows """
+        candidates = self.count - exclude_last
+        if candidates <= 0 or k <= 0:
+            return []
+        scores = self.matrix[:candidates] @ embed_text(query, self.dim)
+        k = min(k, candidates)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = [i for i in top if scores[i] >= MIN_SIMILARITY]
+        return [dict(self.messages[i], score=round(float(scores[i]), 4)) for i in sorted(top)]
+
+    def recent(self, n=DEFAULT_RECENT_TURNS):
+        # ✅ Caught-up rows can land after newer local ones, so order the tail by timestamp
+        return sorted(self.messages[-n:], key=lambda m: m.get("message_ts") or "") if n > 0 else []
+
+    def _download(self):
+        if not CONTEXT_INDEX_BUCKET:
+            return
+        try:
+            data = s3_client.get_object(Bucket=CONTEXT_INDEX_BUCKET, Key=self.s3_key)["Body"].read()
+            count = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])[4]
+            vector_end = HEADER_SIZE + count * self.dim * 4
+            with open(self.text_path, "wb") as f:
+                f.write(data[vector_end:])
+            with open(self.vector_path, "wb") as f:
+                f.write(data[:vector_end])
+        except Exception:
+            self.discard()
+
+    def upload(self):
+        """ Replaces the S3 copy with one PUT, at most once per CONTEXT_INDEX_UPLOAD_SECONDS """
+        if not CONTEXT_INDEX_BUCKET or not self.unsaved or self.closed:
+            return
+        if self.uploaded_at is not None and time.monotonic() - self.uploaded_at < CONTEXT_INDEX_UPLOAD_SECONDS:
+            return
+        header = struct.pack(HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, 0, self.dim, self.count)
+        vectors = np.ascontiguousarray(self.matrix, dtype="<f4").tobytes()
+        texts = "".join(json.dumps(m) + "\n" for m in self.messages).encode("utf-8")
+        s3_client.put_object(Bucket=CONTEXT_INDEX_BUCKET, Key=self.s3_key, Body=header + vectors + texts)
+        self.unsaved = False
+        self.uploaded_at = time.monotonic()
+
+    def discard(self):
+        """ Deletes the local files (the S3 copy and chat_history remain the durable sources) """
+        self.matrix = None
+        for path in (self.text_path, self.vector_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# ✅ Open indexes per user, reused across warm invocations
+open_indexes = OrderedDict()
+open_indexes_lock = threading.Lock()
+
+
+def get_user_index(user_id, bootstrap=None):
+    """ ✅ Returns the user's index; bootstrap() supplies past messages when nothing is on disk or S3 """
+    with open_indexes_lock:
+        index = open_indexes.get(user_id)
+        if index is not None:
+            open_indexes.move_to_end(user_id)
+            return index
+        index = UserContextIndex(user_id)
+        open_indexes[user_id] = index
+        evicted = []
+        while len(open_indexes) > MAX_OPEN_INDEXES:
+            evicted.append(open_indexes.popitem(last=False)[1])
+
+    for old_index in evicted:
+        with old_index.lock:
+            old_index.closed = True
+            old_index.discard()
+
+    with index.lock:
+        if not index.loaded:
+            if not index.load():
+                index.rebuild(bootstrap() if bootstrap else [])
+            index.loaded = True
+    return index
+
+
+def build_context(user_id, message, k=DEFAULT_TOP_K, recent_turns=DEFAULT_RECENT_TURNS, bootstrap=None, since=None,
+                  fetch_newer=None):
+    """ ✅ The k most relevant older messages plus the last few turns of the current session """
+    index = get_user_index(user_id, bootstrap)
+    with index.lock:
+        index.scope(since)
+        if fetch_newer:
+            index.catch_up(fetch_newer)
+        # ✅ No upload here: this runs before Make.com is called; add_message uploads off the reply path
+        return {
+            "relevant_history": index.search(message, k=k, exclude_last=recent_turns),
+            "recent_history": index.recent(recent_turns)
+        }
+
+
+def add_message(user_id, message, role="user", message_ts=None, bootstrap=None, since=None):
+    """ ✅ Indexes a new message (and periodically refreshes the shared S3 copy when configured) """
+    index = get_user_index(user_id, bootstrap)
+    with index.lock:
+        index.scope(since)
+        index.add(message, role, message_ts)
+        index.upload()
@@ -0,0 +1,188 @@
+import time
+import json
+import random
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import get_client
+from instrumentation import context_map
+
+# ✅ Low-level DynamoDB attribute values <-> plain Python types
+# Numbers decode to int when integral and float otherwise (JSON-ready, unlike boto3's Decimal);
+# maps, lists and sets decode recursively.
+
+BATCH_GET_MAX_KEYS = 100  # DynamoDB BatchGetItem limit
+BATCH_WRITE_MAX_ITEMS = 25  # DynamoDB BatchWriteItem limit
+BATCH_MAX_RETRIES = 8
+BATCH_RETRY_BASE_DELAY = 0.05
+BATCH_RETRY_MAX_DELAY = 2.0
+BATCH_MAX_WORKERS = 4
+
+
+def decode_number(value):
+    if "." in value or "e" in value or "E" in value:
+        return float(value)
+    return int(value)
+
+
+def _decode_map(value):
+    return {k: decode(v) for k, v in value.items()}
+
+
+def _decode_list(value):
+    return [decode(v) for v in value]
+
+
+_DECODERS = {
+    "S": str,
+    "N": decode_number,
+    "BOOL": bool,
+    "NULL": lambda value: None,
+    "B": bytes,
+    "M": _decode_map,
+    "L": _decode_list,
+    "SS": set,
+    "NS": lambda value: {decode_number(v) for v in value},
+    "BS": lambda value: {bytes(v) for v in value},
+}
+
+
+# ✅ Function to decode one attribute value, e.g. {"N": "42"} -> 42
+def decode(attribute_value):
+    (tag, value), = attribute_value.items()
+    return _DECODERS[tag](value)
+
+
+# ✅ Function to decode a whole item
+def decode_item(item):
+    return {k: decode(v) for k, v in item.items()} if item else {}
+
+
+def encode_number(value):
+    if isinstance(value, float) and (value != value or value in (float("inf"), float("-inf"))):
+        raise ValueError("DynamoDB numbers cannot be NaN or infinite")
+    return str(value)
+
+
+def _encode_set(value):
+    if not value:
+        raise ValueError("DynamoDB sets cannot be empty")
+    sample = next(iter(value))
+    if isinstance(sample, str):
+        return {"SS": sorted(value)}
+    if isinstance(sample, (bytes, bytearray)):
+        return {"BS": [bytes(v) for v in value]}
+    return {"NS": [encode_number(v) for v in value]}
+
+
+_ENCODERS = {
+    str: lambda value: {"S": value},
+    bool: lambda value: {"BOOL": value},
+    int: lambda value: {"N": str(value)},
+    float: lambda value: {"N": encode_number(value)},
+    Decimal: lambda value: {"N": str(value)},
+    type(None): lambda value: {"NULL": True},
+    bytes: lambda value: {"B": value},
+    bytearray: lambda value: {"B": bytes(value)},
+    dict: lambda value: {"M": {k: encode(v) for k, v in value.items()}},
+    list: lambda value: {"L": [encode(v) for v in value]},
+    tuple: lambda value: {"L": [encode(v) for v in value]},
+    set: _encode_set,
+    frozenset: _encode_set,
+}
+
+
+# ✅ Function to encode one Python value, e.g. 42 -> {"N": "42"}
+def encode(value):
+    encoder = _ENCODERS.get(type(value))
+    if encoder is None:
+        raise TypeError(f"Unsupported type for DynamoDB: {type(value).__name__}")
+    return encoder(value)
+
+
+# ✅ Function to encode a whole item (or key)
+def encode_item(item):
+    return {k: encode(v) for k, v in item.items()}
+
+
+# ✅ Function to build a ProjectionExpression with placeholders (safe for reserved words)
+def build_projection(attributes):
+    if isinstance(attributes, str):
+        attributes = [a.strip() for a in attributes.split(",") if a.strip()]
+    names = {f"#p{i}": name for i, name in enumerate(attributes)}
+    return ", ".join(names), names
+
+
+def _retry_delay(attempt):
+    return random.uniform(0, min(BATCH_RETRY_MAX_DELAY, BATCH_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _batch_get_chunk(client, table_name, keys, request_options):
+    items = []
+    request = {table_name: dict(request_options, Keys=keys)}
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        response = client.batch_get_item(RequestItems=request)
+        items.extend(response.get("Responses", {}).get(table_name, []))
+        request = response.get("UnprocessedKeys") or {}
+        if not request:
+            return items
+        # ✅ Throttled keys come back unprocessed; back off with jitter and retry only those
+        time.sleep(_retry_delay(attempt))
+    raise RuntimeError(f"BatchGetItem left {len(request[table_name]['Keys'])} keys unprocessed")
+
+
+# ✅ Function to read many items by key: 100-key chunks, UnprocessedKeys retried with backoff
+def batch_get_items(table_name, keys, projection=None, consistent_read=False, max_workers=BATCH_MAX_WORKERS, raw=False):
+    """ keys: plain dicts such as {"TS_user_id": "abc"}; returns decoded items (order not guaranteed),
+    or the low-level items when raw=True """
+    client = get_client("dynamodb")
+    keys = list(keys)
+    unique_keys = list({json.dumps(k, sort_keys=True, default=str): encode_item(k) for k in keys}.values())
+    if not unique_keys:
+        return []
+
+    request_options = {"ConsistentRead": consistent_read}
+    if projection:
+        # ✅ Always project the key attributes so callers can match items to keys
+        if isinstance(projection, str):
+            projection = [a.strip() for a in projection.split(",") if a.strip()]
+        projection = list(dict.fromkeys([*projection, *keys[0].keys()]))
+        expression, names = build_projection(projection)
+        request_options["ProjectionExpression"] = expression
+        request_options["ExpressionAttributeNames"] = names
+
+    chunks = [unique_keys[i:i + BATCH_GET_MAX_KEYS] for i in range(0, len(unique_keys), BATCH_GET_MAX_KEYS)]
+    if len(chunks) == 1:
+        raw_items = _batch_get_chunk(client, table_name, chunks[0], request_options)
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            results = context_map(executor, lambda chunk: _batch_get_chunk(client, table_name, chunk, request_options), chunks)
+            raw_items = [item for chunk_items in results for item in chunk_items]
+    return raw_items if raw else [decode_item(item) for item in raw_items]
+
+
+def _batch_write_chunk(client, table_name, requests):
+    request = {table_name: requests}
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        response = client.batch_write_item(RequestItems=request)
+        request = response.get("UnprocessedItems") or {}
+        if not request:
+            return []
+        time.sleep(_retry_delay(attempt))
+    return [r["PutRequest"]["Item"] for r in request[table_name]]
+
+
+# ✅ Function to put many items: 25-item chunks, UnprocessedItems retried with backoff
+def batch_write_items(table_name, items, max_workers=BATCH_MAX_WORKERS, raw=False):
+    """ items: plain dicts (low-level items when raw=True), unique by key;
+    returns the low-level items still unprocessed after retries """
+    client = get_client("dynamodb")
+    requests = [{"PutRequest": {"Item": item if raw else encode_item(item)}} for item in items]
+    if not requests:
+        return []
+
+    chunks = [requests[i:i + BATCH_WRITE_MAX_ITEMS] for i in range(0, len(requests), BATCH_WRITE_MAX_ITEMS)]
+    if len(chunks) == 1:
+        return _batch_write_chunk(client, table_name, chunks[0])
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        results = context_map(executor, lambda chunk: _batch_write_chunk(client, table_name, chunk), chunks)
+        return [item for unprocessed in results for item in unprocessed]
@@ -1,23 +1,37 @@
 import json
-import boto3
 import jwt
-from jwt import PyJWKClient
 import os
+from concurrent.futures import ThreadPoolExecutor
+from token_verification import verify_token
+from aws_clients import lazy_client
+from instrumentation import instrument, record_error, submit
+import profile_cache
+from dynamodb_codec import batch_get_items
 
-# ✅ Initialize AWS Clients
-cognito_client = boto3.client("cognito-idp")
-dynamodb = boto3.client("dynamodb")
+# ✅ AWS Clients (created on first use)
+cognito_client = lazy_client("cognito-idp")
+dynamodb = lazy_client("dynamodb")
 
 # ✅ Environment Variables (Placeholders for Security)
 USER_POOL_ID = os.getenv("USER_POOL_ID", "<COGNITO_USER_POOL_ID>")
 COGNITO_REGION = os.getenv("COGNITO_REGION", "<AWS_REGION>")
-COGNITO_JWKS_URL = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json"
+COGNITO_JWKS_URL = os.getenv("COGNITO_JWKS_URL", f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json")
 TABLE_NAME = os.getenv("DYNAMODB_TABLE_NAME", "<DYNAMODB_USERS_TABLE>")
 COGNITO_APP_CLIENT_ID = os.getenv("COGNITO_APP_CLIENT_ID", "<COGNITO_APP_CLIENT>")
+ALLOWED_UPDATES = ["name", "email", "phone_number", "custom:subscription_status"]
+
+# ✅ Cognito and DynamoDB writes for one request run side by side
+update_executor = ThreadPoolExecutor(max_workers=2)
 
 # ✅ Main Lambda Handler
+@instrument
 def lambda_handler(event, context):
     """ ✅ Handles updating user profile information """
+    # ✅ Direct-invocation bulk mode: {"action": "bulk_update", "source": {"bucket": ..., "key": ...}}
+    if not event.get("headers") and event.get("action") == "bulk_update":
+        import bulk_user_update  # Only bulk jobs pay for loading it
+        return bulk_user_update.handle_bulk_update(event, context)
+
     try:
         headers = event.get("headers", {})
         access_token = headers.get("Authorization")
@@ -32,38 +46,35 @@ def lambda_handler(event, context):
 
         # ✅ Extract request body
         body = json.loads(event.get("body", "{}"))
-        allowed_updates = ["name", "email", "phone_number", "custom:subscription_status"]
-        updates = {key: value for key, value in body.items() if key in allowed_updates}
+        updates = {key: value for key, value in body.items() if key in ALLOWED_UPDATES}
 
         if not updates:
             return {"statusCode": 400, "body": json.dumps({"error": "No valid fields to update."})}
 
-        # ✅ Update Cognito User Attributes
-        update_cognito_user(user_id, updates)
+        # ✅ Update Cognito User Attributes (in the background)
+        cognito_future = submit(update_executor, update_cognito_user, user_id, updates)
 
-        # ✅ (Optional) Update DynamoDB if extra metadata is stored
-        if "extra_data" in body:
-            update_dynamodb_user(user_id, body["extra_data"])
+        # ✅ (Optional) Update DynamoDB if extra metadata is stored, then wait for Cognito
+        try:
+            if "extra_data" in body:
+                update_dynamodb_user(user_id, body["extra_data"])
+        finally:
+            cognito_future.result()
+
+        # ✅ Drop any cached login profile for this user
+        profile_cache.invalidate_profile(user_id)
 
         return {"statusCode": 200, "body": json.dumps({"message": "User profile updated successfully!"})}
     
-    except Exception:
+    except Exception as e:
+        record_error(e)
         return {"statusCode": 500, "body": json.dumps({"error": "Internal Server Error"})}
 
 # ✅ Function to Validate the Access Token
 def validate_access_token(token):
     """ ✅ Validates Cognito access token and extracts the user ID. """
     try:
-        jwk_client = PyJWKClient(COGNITO_JWKS_URL)
-        signing_key = jwk_client.get_signing_key_from_jwt(token).key
-
-        decoded_token = jwt.decode(
-            token,
-            signing_key,
-            algorithms=["RS256"],
-            audience=COGNITO_APP_CLIENT_ID,
-            options={"verify_aud": True},
-        )
+        decoded_token = verify_token(token, COGNITO_JWKS_URL, COGNITO_APP_CLIENT_ID)
         return decoded_token.get("sub"), None
     except jwt.ExpiredSignatureError:
         return None, "Token expired"
@@ -90,3 +101,9 @@ def update_dynamodb_user(user_id, extra_data):
         UpdateExpression="SET extra_data = :data",
         ExpressionAttributeValues={":data": {"S": json.dumps(extra_data)}}
     )
+
+# ✅ Function to Read Many Users (BatchGetItem, 100-key chunks with retries)
+def get_dynamodb_users(user_ids, projection=None):
+    """ ✅ Returns {user_id: item} with typed values for admin and reporting jobs. """
+    items = batch_get_items(TABLE_NAME, [{"user_id": user_id} for user_id in user_ids], projection=projection)
+    return {item.get("user_id"): item for item in items}
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import random
+import base64
+import mimetypes
+from datetime import datetime, timezone
+from aws_clients import lazy_resource, lazy_table
+
+# ✅ AWS Clients (created on first use)
+dynamodb = lazy_resource('dynamodb')
+
+# ✅ Table Layout (Placeholders for Security)
+# Files: PK user_id, SK filename, LSI "updated_at-index" on updated_at
+# Usage: PK "USAGE#<user_id>", SK "#usage" with atomic bytes_used / file_count counters,
+#        plus seeded_at once the user's pre-existing S3 objects have been indexed
+FILE_INDEX_TABLE_NAME = os.getenv('FILE_INDEX_TABLE_NAME', '<DYNAMODB_FILE_INDEX_TABLE>')
+RECENT_INDEX_NAME = 'updated_at-index'
+USAGE_SORT_KEY = '#usage'
+
+# ✅ Storage quotas per role (None = unlimited)
+ROLE_QUOTAS = {
+    'free': 1 * 1024 * 1024 * 1024,  # 1GB
+    'subscriber': 100 * 1024 * 1024 * 1024,  # 100GB
+    'owner': None
+}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+SEEDED_USERS_MAX = 10000
+SEED_CHUNK_SIZE = 99  # DynamoDB TransactWriteItems limit is 100, one slot is the usage update
+SEED_MAX_RETRIES = 3
+SEED_RETRY_BASE_DELAY = 0.05
+
+index_table = lazy_table(FILE_INDEX_TABLE_NAME)
+seeded_users = set()  # ✅ Users known to be seeded, so listings skip the usage read in warm containers
+
+
+def usage_key(user_id):
+    return {'user_id': f'USAGE#{user_id}', 'filename': USAGE_SORT_KEY}
+
+
+# ✅ Function to index objects stored before the index existed; seed() yields (filename, size, last_modified)
+def seed_index(user_id, seed):
+    chunk = []
+    for entry in seed():
+        chunk.append(entry)
+        if len(chunk) == SEED_CHUNK_SIZE:
+            seed_chunk(user_id, chunk)
+            chunk = []
+    if chunk:
+        seed_chunk(user_id, chunk)
+    index_table.update_item(
+        Key=usage_key(user_id),
+        UpdateExpression='SET seeded_at = if_not_exists(seeded_at, :now)',
+        ExpressionAttributeValues={':now': datetime.now(timezone.utc).isoformat()}
+    )
+    mark_seeded(user_id)
+
+
+# ✅ Function to index a chunk of objects and add their bytes in one transaction,
+# so an interrupted seed never leaves indexed files whose bytes were not counted
+def seed_chunk(user_id, chunk):
+    client = index_table.meta.client
+    attempt = 0
+    while chunk:
+        puts = [{'Put': {
+            'TableName': FILE_INDEX_TABLE_NAME,
+            'Item': {
+                'user_id': user_id,
+                'filename': filename,
+                'size': size,
+                'content_type': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                'created_at': last_modified,
+                'updated_at': last_modified
+            },
+            'ConditionExpression': 'attribute_not_exists(filename)'
+        }} for filename, size, last_modified in chunk]
+        usage_update = {'Update': {
+            'TableName': FILE_INDEX_TABLE_NAME,
+            'Key': usage_key(user_id),
+            'UpdateExpression': 'ADD bytes_used :bytes, file_count :files',
+            'ExpressionAttributeValues': {':bytes': sum(size for _, size, _ in chunk), ':files': len(chunk)}
+        }}
+        try:
+            client.transact_write_items(TransactItems=puts + [usage_update])
+            return
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            indexed = {i for i, reason in enumerate(reasons[:len(chunk)]) if reason.get('Code') == 'ConditionalCheckFailed'}
+            if indexed:
+                # ✅ Already indexed by an S3 event (or an earlier seed); its bytes are already counted
+                chunk = [entry for i, entry in enumerate(chunk) if i not in indexed]
+                continue
+            attempt += 1
+            if attempt > SEED_MAX_RETRIES:
+                raise
+            time.sleep(random.uniform(0, SEED_RETRY_BASE_DELAY * (2 ** attempt)))  # ✅ Transaction conflicts
+
+
+def mark_seeded(user_id):
+    if len(seeded_users) >= SEEDED_USERS_MAX:
+        seeded_users.clear()
+    seeded_users.add(user_id)
+
+
+# ✅ Function to seed the index on first use; returns True if it had to (usage must then be re-read)
+def ensure_seeded(user_id, usage_item, seed):
+    if not seed or user_id in seeded_users:
+        return False
+    if usage_item and usage_item.get('seeded_at'):
+        mark_seeded(user_id)
+        return False
+    seed_index(user_id, seed)
+    return True
+
+
+# ✅ Function to read usage and an existing file's size in one BatchGetItem
+def get_usage_and_file(user_id, filename, seed=None):
+    response = dynamodb.batch_get_item(RequestItems={
+        FILE_INDEX_TABLE_NAME: {
+            'Keys': [usage_key(user_id), {'user_id': user_id, 'filename': filename}],
+            'ProjectionExpression': 'user_id, filename, bytes_used, seeded_at, #size',
+            'ExpressionAttributeNames': {'#size': 'size'}
+        }
+    })
+    usage_item, existing_size = None, 0
+    for item in response.get('Responses', {}).get(FILE_INDEX_TABLE_NAME, []):
+        if item['filename'] == USAGE_SORT_KEY and item['user_id'].startswith('USAGE#'):
+            usage_item = item
+        else:
+            existing_size = int(item.get('size', 0))
+    if ensure_seeded(user_id, usage_item, seed):
+        return get_usage_and_file(user_id, filename)
+    return int((usage_item or {}).get('bytes_used', 0)), existing_size
+
+
+# ✅ Function to check an upload against the role quota; returns an error message or None
+def check_quota(user_id, role, filename, file_size, seed=None):
+    quota = ROLE_QUOTAS.get(role)
+    if quota is None:
+        return None
+    bytes_used, existing_size = get_usage_and_file(user_id, filename, seed)
+    # ✅ Overwriting a file only counts the size difference
+    if bytes_used - existing_size + file_size > quota:
+        return f"Storage quota exceeded ({bytes_used} of {quota} bytes used)."
+    return None
+
+
+# ✅ Function to check a batch of uploads (no overwrite credit, so it errs on the safe side)
+def check_batch_quota(user_id, role, sizes, seed=None):
+    # ✅ A negative size would offset the others and let the batch past the quota
+    if any(not isinstance(size, int) or isinstance(size, bool) or size < 0 for size in sizes):
+        return "file_size must be a non-negative integer."
+    quota = ROLE_QUOTAS.get(role)
+    if quota is None:
+        return None
+    bytes_used = get_usage(user_id, seed)['bytes_used']
+    if bytes_used + sum(sizes) > quota:
+        return f"Storage quota exceeded ({bytes_used} of {quota} bytes used)."
+    return None
+
+
+# ✅ Function to adjust the atomic usage counters
+def add_usage(user_id, byte_delta, file_delta):
+    if not byte_delta and not file_delta:
+        return
+    index_table.update_item(
+        Key=usage_key(user_id),
+        UpdateExpression='ADD bytes_used :bytes, file_count :files',
+        ExpressionAttributeValues={':bytes': byte_delta, ':files': file_delta}
+    )
+
+
+# ✅ Function to index a stored object (from S3 ObjectCreated events)
+def record_file(user_id, filename, size, event_time=None):
+    now = event_time or datetime.now(timezone.utc).isoformat()
+    old = index_table.update_item(
+        Key={'user_id': user_id, 'filename': filename},
+        UpdateExpression='SET #size = :size, content_type = :type, updated_at = :now, '
+                         'created_at = if_not_exists(created_at, :now)',
+        ExpressionAttributeNames={'#size': 'size'},
+        ExpressionAttributeValues={
+            ':size': size,
+            ':type': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            ':now': now
+        },
+        ReturnValues='UPDATED_OLD'
+    ).get('Attributes', {})
+    # ✅ Overwrites only change the byte count; new files also bump file_count
+    if 'size' in old:
+        add_usage(user_id, size - int(old['size']), 0)
+    else:
+        add_usage(user_id, size, 1)
+
+
+# ✅ Function to drop an object from the index (from S3 ObjectRemoved events)
+def remove_file(user_id, filename):
+    old = index_table.delete_item(
+        Key={'user_id': user_id, 'filename': filename},
+        ReturnValues='ALL_OLD'
+    ).get('Attributes')
+    if old:
+        add_usage(user_id, -int(old.get('size', 0)), -1)
+
+
+def encode_cursor(last_key):
+    return base64.urlsafe_b64encode(json.dumps(last_key, default=str).encode('utf-8')).decode('ascii') if last_key else None
+
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+
+
+# ✅ Function to list a user's files from the index: sort = name | recent, order = asc | desc
+def list_files(user_id, limit=DEFAULT_PAGE_SIZE, cursor=None, sort='name', order='asc', seed=None):
+    from boto3.dynamodb.conditions import Key  # boto3 is only loaded once a query runs
+    if seed and user_id not in seeded_users:
+        get_usage(user_id, seed)
+    kwargs = {
+        'KeyConditionExpression': Key('user_id').eq(user_id),
+        'ProjectionExpression': 'filename, #size, content_type, created_at, updated_at',
+        'ExpressionAttributeNames': {'#size': 'size'},
+        'ScanIndexForward': order != 'desc',
+        'Limit': max(1, min(int(limit), MAX_PAGE_SIZE))
+    }
+    if sort == 'recent':
+        kwargs['IndexName'] = RECENT_INDEX_NAME
+    if cursor:
+        kwargs['ExclusiveStartKey'] = decode_cursor(cursor)
+
+    response = index_table.query(**kwargs)
+    files = [dict(item, size=int(item.get('size', 0))) for item in response.get('Items', [])]
+    return files, encode_cursor(response.get('LastEvaluatedKey'))
+
+
+# ✅ Function to read a user's current usage
+def get_usage(user_id, seed=None):
+    item = index_table.get_item(Key=usage_key(user_id)).get('Item') or {}
+    if ensure_seeded(user_id, item, seed):
+        return get_usage(user_id)
+    return {'bytes_used': int(item.get('bytes_used', 0)), 'file_count': int(item.get('file_count', 0))}
@@ -0,0 +1,253 @@
+import os
+import io
+import json
+import time
+import random
+import logging
+import pstats
+import cProfile
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ Instrumentation Settings
+# One CloudWatch Embedded Metric Format (EMF) line per invocation: total duration, cold start,
+# and per-dependency call counts, durations and error classes (dynamodb, s3, cognito-idp, make, ...).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "TaskSensei")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # Fraction of invocations run under cProfile
+PROFILE_PERCENTILE = float(os.getenv("PROFILE_PERCENTILE", "99"))  # Only keep profiles this slow or slower
+PROFILE_MIN_SAMPLES = 20
+PROFILE_TOP_FUNCTIONS = 15
+# Direct-invocation actions used as the Route dimension; any other caller-supplied action is reported as "other"
+# so clients cannot create unbounded metric dimensions
+KNOWN_ACTIONS = {"upload", "delete", "list", "multipart", "push", "bulk_update"}
+
+cold_start = True
+# ✅ The running invocation; worker threads see it only when started through submit()/context_map()
+current_invocation = contextvars.ContextVar("current_invocation", default=None)
+recent_durations = deque(maxlen=500)
+profile_hook = None  # Optional fn(invocation, stats_text) replacing the default log line
+
+
+class Invocation:
+    """ ✅ Per-invocation timing record """
+
+    def __init__(self, function, route, cold, request_id):
+        self.function = function
+        self.route = route
+        self.cold = cold
+        self.request_id = request_id
+        self.dependencies = {}
+        self.error = None
+        self.lock = threading.Lock()
+
+    def add_call(self, dependency, operation, duration_ms, error=None):
+        with self.lock:
+            stats = self.dependencies.setdefault(dependency, {"calls": 0, "ms": 0.0, "max_ms": 0.0, "ops": {}, "errors": {}})
+            stats["calls"] += 1
+            stats["ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+            stats["ops"][operation] = stats["ops"].get(operation, 0) + 1
+            if error:
+                stats["errors"][error] = stats["errors"].get(error, 0) + 1
+
+
+class Call:
+    """ ✅ Yielded by timed(); set .error for failures that are not exceptions (e.g. HTTP 5xx) """
+    error = None
+
+
+# ✅ Function to record one outbound call against the current invocation
+def record_call(dependency, operation, duration_ms, error=None):
+    invocation = current_invocation.get()
+    if invocation is not None:
+        invocation.add_call(dependency, operation, duration_ms, error)
+
+
+# ✅ Function to record an exception a handler caught and turned into a 500
+def record_error(error):
+    invocation = current_invocation.get()
+    if invocation is not None:
+        invocation.error = type(error).__name__
+
+
+# ✅ Executor helpers: run a task in a copy of the caller's context so its calls count toward the caller's invocation
+def submit(executor, fn, *args, **kwargs):
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def context_map(executor, fn, items):
+    """ ✅ Like executor.map (results in order), with one context copy per task """
+    futures = [submit(executor, fn, item) for item in items]
+    return [future.result() for future in futures]
+
+
+@contextmanager
+def timed(dependency, operation):
+    """ ✅ Times an outbound call: with timed("make", "post") as call: ... """
+    call = Call()
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        call.error = type(e).__name__
+        raise
+    finally:
+        record_call(dependency, operation, (time.perf_counter() - started) * 1000, call.error)
+
+
+# ✅ botocore hooks: every AWS API call made through aws_clients is timed, retries included
+def _before_call(model, context, **kwargs):
+    context["instrumentation"] = (model.service_model.service_name, model.name, time.perf_counter())
+
+
+def _after_call(http_response, parsed, context, **kwargs):
+    started = context.pop("instrumentation", None)
+    if started:
+        service, operation, started_at = started
+        error = parsed.get("Error", {}).get("Code") if http_response.status_code >= 300 else None
+        record_call(service, operation, (time.perf_counter() - started_at) * 1000, error or None)
+
+
+def _after_call_error(exception, context, **kwargs):
+    started = context.pop("instrumentation", None)
+    if started:
+        service, operation, started_at = started
+        record_call(service, operation, (time.perf_counter() - started_at) * 1000, type(exception).__name__)
+
+
+def register_botocore_hooks(session):
+    """ ✅ Called by aws_clients for every session it hands out """
+    session.events.register_first("before-call", _before_call)
+    session.events.register("after-call", _after_call)
+    session.events.register("after-call-error", _after_call_error)
+
+
+def get_route(event):
+    if not isinstance(event, dict):
+        return "unknown"
+    route_key = (event.get("requestContext") or {}).get("routeKey")
+    if route_key:
+        return route_key
+    if event.get("resource"):
+        return event["resource"]
+    if event.get("Records"):
+        record = event["Records"][0]
+        return record.get("eventSource") or record.get("EventSource") or "records"
+    action = event.get("action")
+    if not action:
+        return "direct"
+    return action if isinstance(action, str) and action in KNOWN_ACTIONS else "other"
+
+
+def build_emf(invocation, duration_ms, status_code):
+    metrics = [
+        {"Name": "Duration", "Unit": "Milliseconds"},
+        {"Name": "ColdStart", "Unit": "Count"},
+        {"Name": "Errors", "Unit": "Count"}
+    ]
+    record = {
+        "Function": invocation.function,
+        "Route": invocation.route,
+        "RequestId": invocation.request_id,
+        "Duration": round(duration_ms, 2),
+        "ColdStart": int(invocation.cold),
+        "Errors": int(bool(invocation.error) or (isinstance(status_code, int) and status_code >= 500)),
+        "StatusCode": status_code,
+        "Dependencies": {}
+    }
+    if invocation.error:
+        record["ErrorClass"] = invocation.error
+    for dependency, stats in sorted(invocation.dependencies.items()):
+        name = dependency.replace("-", "_")
+        metrics.append({"Name": f"{name}_ms", "Unit": "Milliseconds"})
+        metrics.append({"Name": f"{name}_calls", "Unit": "Count"})
+        record[f"{name}_ms"] = round(stats["ms"], 2)
+        record[f"{name}_calls"] = stats["calls"]
+        record["Dependencies"][dependency] = {
+            "max_ms": round(stats["max_ms"], 2),
+            "ops": stats["ops"],
+            **({"errors": stats["errors"]} if stats["errors"] else {})
+        }
+    record["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{
+            "Namespace": METRICS_NAMESPACE,
+            "Dimensions": [["Function"], ["Function", "Route"]],
+            "Metrics": metrics
+        }]
+    }
+    return record
+
+
+# ✅ Sampled profiling: keep a profile only when its invocation lands in the slowest percentile
+def is_slow(duration_ms):
+    if len(recent_durations) < PROFILE_MIN_SAMPLES:
+        return False
+    ordered = sorted(recent_durations)
+    threshold = ordered[min(len(ordered) - 1, int(len(ordered) * PROFILE_PERCENTILE / 100))]
+    return duration_ms >= threshold
+
+
+def report_profile(invocation, profiler, duration_ms):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    if profile_hook:
+        profile_hook(invocation, output.getvalue())
+        return
+    logger.info(json.dumps({
+        "profile": invocation.function,
+        "route": invocation.route,
+        "request_id": invocation.request_id,
+        "duration_ms": round(duration_ms, 2),
+        "stats": output.getvalue()
+    }))
+
+
+# ✅ Handler decorator: cold/warm flag, per-dependency timings, one EMF line per invocation
+def instrument(handler):
+    function = handler.__module__
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global cold_start
+        invocation = Invocation(function, get_route(event), cold_start, getattr(context, "aws_request_id", None))
+        cold_start = False
+        token = current_invocation.set(invocation)
+
+        profiler = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        status_code = None
+        started = time.perf_counter()
+        try:
+            result = handler(event, context)
+            if isinstance(result, dict):
+                status_code = result.get("statusCode")
+            return result
+        except Exception as e:
+            invocation.error = type(e).__name__
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if profiler:
+                profiler.disable()
+                if is_slow(duration_ms):
+                    try:
+                        report_profile(invocation, profiler, duration_ms)
+                    except Exception as e:
+                        logger.warning("Failed to report profile: %s", e)
+            recent_durations.append(duration_ms)
+            current_invocation.reset(token)
+            if METRICS_ENABLED:
+                print(json.dumps(build_emf(invocation, duration_ms, status_code), separators=(",", ":")))
+
+    return wrapper
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from instrumentation import timed
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ Client Settings
+MAKE_CONNECT_TIMEOUT = float(os.getenv("MAKE_CONNECT_TIMEOUT", "2"))
+MAKE_READ_TIMEOUT = float(os.getenv("MAKE_READ_TIMEOUT", "10"))
+MAKE_MAX_RETRIES = 2
+MAKE_RETRY_BASE_DELAY = 0.2
+MAKE_RETRY_MAX_DELAY = 1.0
+MAKE_MAX_IN_FLIGHT = 4
+RETRYABLE_STATUS_CODES = {429, 503}  # Make.com rejected the request without running the scenario
+STREAM_CHUNK_SIZE = 512
+SSE_TEXT_FIELDS = ("response", "delta", "text")
+
+# ✅ Circuit Breaker Settings
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+FALLBACK_REPLY = os.getenv(
+    "MAKE_FALLBACK_REPLY",
+    "TaskSensei is busy right now. Please try again in a moment."
+)
+
+
+class CircuitBreaker:
+    """ ✅ closed -> open after repeated failures -> half_open trial after a cool-down """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    logger.warning("Make.com circuit breaker opened after %d failures", self.consecutive_failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class MakeWebhookClient:
+    """ ✅ Keep-alive webhook client with retries, circuit breaker and an in-flight limit """
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAKE_MAX_IN_FLIGHT, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (MAKE_CONNECT_TIMEOUT, MAKE_READ_TIMEOUT)
+        self.breaker = CircuitBreaker()
+        self._in_flight = threading.BoundedSemaphore(MAKE_MAX_IN_FLIGHT)
+        self.counters = {
+            "requests": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "short_circuited": 0,
+            "rejected_in_flight": 0
+        }
+
+    def _count(self, name):
+        self.counters[name] += 1
+
+    @staticmethod
+    def fallback_response():
+        return {"response": FALLBACK_REPLY, "fallback": True}
+
+    @staticmethod
+    def error_response(message):
+        """ Placeholder reply shown to the user but never cached or stored as a turn """
+        return {"response": message, "error": True}
+
+    @staticmethod
+    def _retry_delay(attempt):
+        # ✅ Full jitter keeps retries from many containers from lining up
+        return random.uniform(0, min(MAKE_RETRY_MAX_DELAY, MAKE_RETRY_BASE_DELAY * (2 ** attempt)))
+
+    @staticmethod
+    def _never_sent(error):
+        """ True only when the connection itself could not be opened, so the POST provably never left """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _send(self, url, payload, stream=False):
+        """ Sends with retries for failures where Make.com never ran the scenario """
+        attempt = 0
+        while True:
+            try:
+                with timed("make", "post") as call:
+                    response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+                    if response.status_code >= 400:
+                        call.error = f"HTTP{response.status_code}"
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= MAKE_MAX_RETRIES:
+                    return response
+                response.close()
+            except requests.exceptions.ConnectionError as e:
+                # ✅ Dropped connections ("Connection aborted") and read timeouts are not retried:
+                # the body may already have been sent and the scenario may already be running
+                if not self._never_sent(e) or attempt >= MAKE_MAX_RETRIES:
+                    raise
+            attempt += 1
+            self._count("retries")
+            time.sleep(self._retry_delay(attempt))
+
+    def open_request(self, url, payload, stream=False):
+        """ Returns (response, None) or (None, fallback_dict) when the call is short-circuited or fails """
+        if not self._in_flight.acquire(blocking=False):
+            self._count("rejected_in_flight")
+            return None, self.fallback_response()
+        if not self.breaker.allow_request():
+            self._in_flight.release()
+            self._count("short_circuited")
+            return None, self.fallback_response()
+
+        self._count("requests")
+        try:
+            response = self._send(url, payload, stream=stream)
+        except requests.exceptions.RequestException as e:
+            self._in_flight.release()
+            self._record_failure(e)
+            return None, self.fallback_response()
+        self._in_flight.release()
+
+        if response.status_code >= 500 or response.status_code in RETRYABLE_STATUS_CODES:
+            self._record_failure(f"HTTP {response.status_code}")
+            response.close()
+            return None, self.fallback_response()
+        if response.status_code >= 400:
+            # ✅ Client errors mean a bad payload or URL, not a degraded Make.com
+            self.breaker.record_success()
+            self._count("failures")
+            response.close()
+            return None, self.error_response("Request Error to Make.com")
+
+        self.breaker.record_success()
+        self._count("successes")
+        return response, None
+
+    def _record_failure(self, error):
+        logger.warning("Make.com request failed: %s", error)
+        self._count("failures")
+        self.breaker.record_failure()
+
+    def post(self, url, payload):
+        """ ✅ Posts the payload and returns the decoded reply (or a fallback reply) """
+        response, fallback = self.open_request(url, payload)
+        if fallback:
+            return fallback
+        return self._decode_reply(response)
+
+    def _decode_reply(self, response):
+        """ Decodes a complete JSON reply; an empty body or one without reply text becomes an error reply """
+        with response:
+            try:
+                body = response.json() if response.content else None
+            except ValueError:
+                return {"response": response.text}
+        if body is None:
+            return self.error_response("Success")
+        if not isinstance(body, dict) or not isinstance(body.get("response"), str):
+            return self.error_response("No response from Make.com")
+        return body
+
+    def open_stream(self, url, payload):
+        """ ✅ Returns (chunks, None), or (None, reply_dict) for a complete JSON reply, a fallback or an error """
+        response, fallback = self.open_request(url, payload, stream=True)
+        if fallback:
+            return None, fallback
+        if "application/json" in response.headers.get("Content-Type", ""):
+            try:
+                return None, self._decode_reply(response)
+            except requests.exceptions.RequestException as e:
+                self._record_failure(e)
+                return None, self.fallback_response()
+        return self._iter_reply(response), None
+
+    def _iter_reply(self, response):
+        """ Yields reply text as it arrives: SSE "data:" lines or raw chunks """
+        with response:
+            try:
+                content_type = response.headers.get("Content-Type", "")
+                if "text/event-stream" in content_type:
+                    yield from self._iter_sse(response)
+                else:
+                    response.encoding = response.encoding or "utf-8"
+                    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=True):
+                        if chunk:
+                            yield chunk
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self._record_failure(e)
+                raise  # ✅ Let the relay end the stream with an error frame, not a normal "done"
+
+    @staticmethod
+    def _iter_sse(response):
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].lstrip()
+            if data == "[DONE]":
+                return
+            try:
+                decoded = json.loads(data)
+            except ValueError:
+                yield data
+                continue
+            if isinstance(decoded, dict):
+                text = next((decoded[f] for f in SSE_TEXT_FIELDS if isinstance(decoded.get(f), str)), "")
+            else:
+                text = str(decoded)
+            if text:
+                yield text
+
+    def get_stats(self):
+        return dict(
+            self.counters,
+            breaker_state=self.breaker.state,
+            breaker_times_opened=self.breaker.times_opened,
+            consecutive_failures=self.breaker.consecutive_failures
+        )
+
+
+# ✅ Shared client (survives across warm invocations)
+make_client = MakeWebhookClient()
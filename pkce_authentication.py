@@ -1,42 +1,49 @@
+import os
 import json
 import jwt
-import boto3
+import base64
 import logging
 import requests
-from jwt import PyJWKClient
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from token_verification import verify_token
+from aws_clients import lazy_client
+from instrumentation import instrument, timed, record_error, submit
+import profile_cache
+import token_refresh
+from dynamodb_codec import decode_item, batch_get_items
+from http.cookies import SimpleCookie
 
 # Setup Logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# AWS Clients
-cognito = boto3.client('cognito-idp')
-dynamodb = boto3.client('dynamodb')
-s3 = boto3.client('s3')
+# AWS Clients (created on first use)
+cognito = lazy_client('cognito-idp')
+dynamodb = lazy_client('dynamodb')
 
 # Constants (Placeholders for sensitive information)
-USER_POOL_ID = "<USER_POOL_ID>"
-COGNITO_REGION = "<COGNITO_REGION>"
-APP_CLIENT_ID = "<APP_CLIENT_ID>"
-COGNITO_TOKEN_URL = f"https://login.example.com/oauth2/token"
-COGNITO_JWKS_URL = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json"
-DYNAMODB_TABLE_NAME = "<DYNAMODB_TABLE_NAME>"
+USER_POOL_ID = os.getenv("USER_POOL_ID", "<USER_POOL_ID>")
+COGNITO_REGION = os.getenv("COGNITO_REGION", "<COGNITO_REGION>")
+APP_CLIENT_ID = os.getenv("COGNITO_APP_CLIENT_ID", "<APP_CLIENT_ID>")
+COGNITO_TOKEN_URL = os.getenv("COGNITO_TOKEN_URL", "https://login.example.com/oauth2/token")
+COGNITO_JWKS_URL = os.getenv("COGNITO_JWKS_URL", f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json")
+DYNAMODB_TABLE_NAME = os.getenv("DYNAMODB_TABLE_NAME", "<DYNAMODB_TABLE_NAME>")
 S3_BUCKET_NAME = "<S3_BUCKET_NAME>"
+TOKEN_REQUEST_TIMEOUT = (2, 5)  # (connect, read) seconds
+
+# Pooled HTTP session for the token endpoint (keep-alive across warm invocations)
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+
+# Worker pool for fetching Cognito attributes and DynamoDB data at the same time
+hydration_executor = ThreadPoolExecutor(max_workers=2)
 
 # Helper Functions
 def validate_id_token(token):
     """ Validates JWT ID Token against Cognito JWKs """
     try:
-        jwk_client = PyJWKClient(COGNITO_JWKS_URL)
-        signing_key = jwk_client.get_signing_key_from_jwt(token).key
-
-        decoded_token = jwt.decode(
-            token,
-            signing_key,
-            algorithms=["RS256"],
-            audience=APP_CLIENT_ID,
-            options={"verify_aud": True} 
-        )
+        decoded_token = verify_token(token, COGNITO_JWKS_URL, APP_CLIENT_ID)
 
         username = decoded_token.get("cognito:username", decoded_token.get("sub", "unknown_user"))
         return True, decoded_token, username
@@ -59,7 +66,10 @@ def exchange_code_for_tokens(auth_code, code_verifier):
             "code_verifier": code_verifier
         }
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(COGNITO_TOKEN_URL, data=data, headers=headers)
+        with timed("cognito_token", data["grant_type"]) as call:
+            response = http_session.post(COGNITO_TOKEN_URL, data=data, headers=headers, timeout=TOKEN_REQUEST_TIMEOUT)
+            if response.status_code >= 400:
+                call.error = f"HTTP{response.status_code}"
 
         if response.status_code == 200:
             return response.json()
@@ -67,6 +77,35 @@ def exchange_code_for_tokens(auth_code, code_verifier):
     except Exception:
         return None
 
+def refresh_tokens_with_cognito(refresh_token):
+    """ Exchanges a Refresh Token for new Access/ID Tokens via Cognito """
+    try:
+        data = {
+            "grant_type": "refresh_token",
+            "client_id": APP_CLIENT_ID,
+            "refresh_token": refresh_token
+        }
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        with timed("cognito_token", data["grant_type"]) as call:
+            response = http_session.post(COGNITO_TOKEN_URL, data=data, headers=headers, timeout=TOKEN_REQUEST_TIMEOUT)
+            if response.status_code >= 400:
+                call.error = f"HTTP{response.status_code}"
+
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except Exception:
+        return None
+
+def get_refresh_token(event, body):
+    """ Reads the refresh token from the request body or the refresh_token cookie """
+    if body.get("refresh_token"):
+        return body["refresh_token"]
+    headers = event.get("headers") or {}
+    cookie_header = headers.get("Cookie") or headers.get("cookie") or ""
+    morsel = SimpleCookie(cookie_header).get("refresh_token")
+    return morsel.value if morsel else None
+
 def get_user_cognito_attributes(access_token):
     """ Fetches user attributes from Cognito """
     try:
@@ -83,11 +122,37 @@ def get_user_dynamodb_data(username):
             TableName=DYNAMODB_TABLE_NAME,
             Key={"TS_user_id": {"S": username}}
         )
-        user_data = response.get("Item", {})
-        return {k: list(v.values())[0] for k, v in user_data.items()} if user_data else {}
+        return decode_item(response.get("Item"))
     except Exception:
         return {}
 
+def get_users_dynamodb_data(usernames, projection=None):
+    """ Fetches many users' data in BatchGetItem chunks (admin / reporting jobs) """
+    items = batch_get_items(DYNAMODB_TABLE_NAME, [{"TS_user_id": u} for u in usernames], projection=projection)
+    return {item.get("TS_user_id"): item for item in items}
+
+def json_default(value):
+    """ Makes decoded DynamoDB sets and binary values JSON-serializable """
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def get_hydrated_profile(access_token, username, aliases=()):
+    """ Returns Cognito attributes + DynamoDB user data, from cache or fetched in parallel """
+    profile = profile_cache.get_cached_profile(username, aliases)
+    if profile is not None:
+        return profile
+
+    attributes_future = submit(hydration_executor, get_user_cognito_attributes, access_token)
+    user_data_future = submit(hydration_executor, get_user_dynamodb_data, username)
+    attributes, _ = attributes_future.result()
+    profile = {"attributes": attributes, "user_data": user_data_future.result()}
+    if attributes:
+        profile_cache.put_profile(username, profile)
+    return profile
+
 def generate_response(status_code, body, access_token=None, refresh_token=None):
     """ Returns API response with proper headers & cookies """
     if access_token:
@@ -96,7 +161,7 @@ def generate_response(status_code, body, access_token=None, refresh_token=None):
         body["refresh_token"] = refresh_token
     response = {
         "statusCode": status_code,
-        "body": json.dumps(body),
+        "body": json.dumps(body, default=json_default),
         "headers": {
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Credentials": "true",
@@ -135,20 +200,50 @@ def handle_login(event):
             return generate_response(401, {"error": "Invalid ID token"})
 
         email = decoded_id_token.get("email")
+        profile = get_hydrated_profile(access_token, username, aliases=(decoded_id_token.get("sub"),))
         return generate_response(
             200,
             {
                 "message": "Login successful",
                 "user_id": username,
                 "email": email,
+                "profile": profile,
                 "redirect": "http://localhost/dashboard"
             },
             access_token=access_token,
             refresh_token=refresh_token
         )
-    except Exception:
+    except Exception as e:
+        record_error(e)
+        return generate_response(500, {"error": "Internal Server Error"})
+
+def handle_refresh(event):
+    """ Handles Token Refresh (concurrent refreshes are coalesced across containers, see token_refresh.py) """
+    try:
+        body = json.loads(event.get("body") or "{}")
+        refresh_token = get_refresh_token(event, body)
+        if not refresh_token:
+            return generate_response(400, {"error": "Missing refresh token"})
+
+        tokens, expires_in = token_refresh.get_tokens(refresh_token, refresh_tokens_with_cognito)
+        if not tokens:
+            return generate_response(401, {"error": "Invalid refresh token"})
+
+        return generate_response(
+            200,
+            {
+                "message": "Token refreshed",
+                "id_token": tokens.get("id_token"),
+                "expires_in": expires_in
+            },
+            access_token=tokens.get("access_token"),
+            refresh_token=tokens.get("refresh_token")  # Only set when Cognito rotates it
+        )
+    except Exception as e:
+        record_error(e)
         return generate_response(500, {"error": "Internal Server Error"})
 
+@instrument
 def lambda_handler(event, context):
     """ Main Lambda Handler """
     http_method = event.get("httpMethod", "UNKNOWN")
@@ -158,5 +253,7 @@ def lambda_handler(event, context):
         resource_path = event.get("resource", "Unknown")
         if resource_path == "/auth":
             return handle_login(event)
+        if resource_path == "/refresh":
+            return handle_refresh(event)
         return generate_response(404, {"error": "Resource Not Found"})
     return generate_response(405, {"error": "Method Not Allowed"})
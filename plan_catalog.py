@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import logging
+import threading
+import stripe
+from instrumentation import timed
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ Catalog Settings (Placeholders for Security)
+# STRIPE_PLAN_PRICES maps plan names to existing Stripe Price IDs, e.g. {"pro": "price_123"}
+STRIPE_PLAN_PRICES = os.getenv("STRIPE_PLAN_PRICES", '{"pro": "<STRIPE_PRO_PRICE_ID>"}')
+CATALOG_TTL_SECONDS = 15 * 60
+CATALOG_RETRY_SECONDS = 30  # After a failed Stripe call, try again this soon instead of waiting out the TTL
+
+catalog = {}
+catalog_loaded_at = 0.0  # Last refresh where every configured price loaded
+next_refresh_at = 0.0
+unavailable_plans = set()  # Configured plans with no price yet because Stripe could not be reached
+catalog_lock = threading.Lock()
+
+
+def configured_prices():
+    return {plan.lower(): price_id for plan, price_id in json.loads(STRIPE_PLAN_PRICES).items()}
+
+
+# ✅ Function to fetch and validate every configured price (one Stripe call per plan)
+def load_catalog():
+    """ Returns (plans, failed): valid plans, and plans whose price could not be fetched """
+    plans = {}
+    failed = set()
+    for plan, price_id in configured_prices().items():
+        try:
+            with timed("stripe", "Price.retrieve"):
+                price = stripe.Price.retrieve(price_id).to_dict()  # StripeObject is not a dict
+        except stripe.error.StripeError as e:
+            logger.error("Plan %s: cannot load price %s: %s", plan, price_id, e)
+            failed.add(plan)
+            continue
+        recurring = price.get("recurring")
+        if not price.get("active") or not recurring:
+            logger.error("Plan %s: price %s is inactive or not recurring", plan, price_id)
+            continue
+        plans[plan] = {
+            "price_id": price["id"],
+            "product": price.get("product"),
+            "currency": price.get("currency"),
+            "unit_amount": price.get("unit_amount"),
+            "interval": recurring.get("interval")
+        }
+    return plans, failed
+
+
+# ✅ Function to refresh the warm-container catalog once it is older than the TTL
+def refresh_catalog(force=False):
+    global catalog, catalog_loaded_at, next_refresh_at, unavailable_plans
+    with catalog_lock:
+        now = time.time()
+        if not force and now < next_refresh_at:
+            return catalog
+        configured = configured_prices()
+        try:
+            plans, failed = load_catalog()
+        except Exception as e:
+            plans, failed = {}, set(configured)
+            logger.error("Plan catalog refresh failed: %s", e)
+        # ✅ Merge per plan: a plan whose fetch failed keeps its previous entry
+        merged = {}
+        for plan in configured:
+            entry = plans.get(plan) or (catalog.get(plan) if plan in failed else None)
+            if entry:
+                merged[plan] = entry
+        catalog = merged
+        unavailable_plans = failed - set(merged)
+        if failed:
+            next_refresh_at = now + CATALOG_RETRY_SECONDS
+        else:
+            catalog_loaded_at = now
+            next_refresh_at = now + CATALOG_TTL_SECONDS
+        return catalog
+
+
+# ✅ Function to look up a plan; returns None for unknown or invalid plans
+def get_plan(plan):
+    return refresh_catalog().get(plan.lower())
+
+
+# ✅ Function to tell an unknown plan from a configured one whose price could not be loaded yet
+def is_unavailable(plan):
+    return plan.lower() in unavailable_plans
@@ -0,0 +1,110 @@
+import os
+import time
+import logging
+import threading
+from decimal import Decimal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import lazy_resource
+from instrumentation import context_map
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ AWS Clients (created on first use)
+dynamodb = lazy_resource("dynamodb")
+
+# ✅ Cache Settings (Placeholders for Security)
+# Invalidation marker: attribute profile_invalidated_at (epoch seconds) on the user's TS_user_id item.
+# Writers in other Lambdas set it; readers drop any cached profile older than the marker.
+USERS_TABLE_NAME = os.getenv("USERS_TABLE_NAME", "<DYNAMODB_USERS_TABLE>")
+INVALIDATED_AT_ATTRIBUTE = "profile_invalidated_at"
+PROFILE_CACHE_TTL_SECONDS = 60
+PROFILE_CACHE_MAX_ENTRIES = 512
+INVALIDATION_MAX_WORKERS = 8
+
+profiles = OrderedDict()
+profiles_lock = threading.Lock()
+invalidation_executor = ThreadPoolExecutor(max_workers=INVALIDATION_MAX_WORKERS)
+
+
+# ✅ Function to read the newest invalidation time for any of the user's ids (one BatchGetItem on the users table)
+def get_invalidated_at(user_ids):
+    response = dynamodb.batch_get_item(RequestItems={
+        USERS_TABLE_NAME: {
+            "Keys": [{"TS_user_id": user_id} for user_id in user_ids],
+            "ProjectionExpression": INVALIDATED_AT_ATTRIBUTE
+        }
+    })
+    items = response.get("Responses", {}).get(USERS_TABLE_NAME, [])
+    return max((float(item.get(INVALIDATED_AT_ATTRIBUTE, 0)) for item in items), default=0.0)
+
+
+# ✅ Function to return a cached profile unless it expired or was invalidated
+def get_cached_profile(user_id, aliases=()):
+    with profiles_lock:
+        entry = profiles.get(user_id)
+    if entry is None:
+        return None
+    profile, cached_at = entry
+    if time.time() - cached_at > PROFILE_CACHE_TTL_SECONDS:
+        drop_local(user_id)
+        return None
+
+    user_ids = list(dict.fromkeys([user_id, *[a for a in aliases if a]]))
+    try:
+        invalidated_at = get_invalidated_at(user_ids)
+    except Exception as e:
+        logger.warning("Profile invalidation check failed: %s", e)
+        return None
+    if invalidated_at >= cached_at:
+        drop_local(user_id)
+        return None
+    return profile
+
+
+# ✅ Function to cache a freshly hydrated profile
+def put_profile(user_id, profile):
+    with profiles_lock:
+        profiles[user_id] = (profile, time.time())
+        profiles.move_to_end(user_id)
+        while len(profiles) > PROFILE_CACHE_MAX_ENTRIES:
+            profiles.popitem(last=False)
+
+
+def drop_local(user_id):
+    with profiles_lock:
+        profiles.pop(user_id, None)
+
+
+# ✅ Function to stamp the marker; only existing user items are touched, so aliases never create stray users
+def mark_invalidated(user_id, now):
+    try:
+        dynamodb.Table(USERS_TABLE_NAME).update_item(
+            Key={"TS_user_id": user_id},
+            UpdateExpression=f"SET {INVALIDATED_AT_ATTRIBUTE} = :now",
+            ConditionExpression="attribute_exists(TS_user_id)",
+            ExpressionAttributeValues={":now": Decimal(str(now))}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+# ✅ Function for writers (dynamodb_handler) to invalidate a user's profile everywhere
+def invalidate_profile(user_id):
+    drop_local(user_id)
+    try:
+        mark_invalidated(user_id, time.time())
+    except Exception as e:
+        logger.warning("Failed to invalidate cached profile for %s: %s", user_id, e)
+
+
+# ✅ Function for bulk jobs to invalidate many profiles (marker updates run in parallel)
+def invalidate_profiles(user_ids):
+    now = time.time()
+    for user_id in user_ids:
+        drop_local(user_id)
+    try:
+        context_map(invalidation_executor, lambda user_id: mark_invalidated(user_id, now), user_ids)
+    except Exception as e:
+        logger.warning("Failed to invalidate %d cached profiles: %s", len(user_ids), e)
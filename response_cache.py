@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from aws_clients import lazy_table
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ Cache Settings (Placeholders for Security)
+# Shared tier: PK cache_key, TTL attribute expires_at
+RESPONSE_CACHE_TABLE_NAME = os.getenv("RESPONSE_CACHE_TABLE_NAME", "<DYNAMODB_RESPONSE_CACHE_TABLE>")
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+MEMORY_MAX_BYTES = 2 * 1024 * 1024
+MEMORY_TTL_SECONDS = 10 * 60
+SHARED_TTL_SECONDS = 24 * 60 * 60
+MAX_CACHEABLE_MESSAGE_CHARS = 300
+CONTEXT_FIELDS = ("plan", "role", "language")  # Request fields that can change the answer
+
+# ✅ Only allowlisted FAQs are cached (nothing is cached until RESPONSE_CACHE_ALLOWLIST is set), and never
+# personal details, messages that trigger automations, or requests that carry conversation context
+ALLOWLIST_PATTERNS = [re.compile(p) for p in os.getenv("RESPONSE_CACHE_ALLOWLIST", "").split(",") if p]
+PERSONAL_PATTERN = re.compile(r"\b(my|mine|me|myself)\b|@|\d{4,}")
+AUTOMATION_PATTERN = re.compile(
+    r"^(please\s+)?(send|schedule|create|delete|remove|book|remind|run|trigger|start|stop|cancel|add|update|upload|email)\b"
+)
+
+cache_table = lazy_table(RESPONSE_CACHE_TABLE_NAME)
+
+
+# ✅ Function to normalize message text ("How do I upload a file?" == "how do i upload a file")
+def normalize_message(message):
+    return " ".join(re.sub(r"[^\w\s]", " ", message.lower()).split())
+
+
+# ✅ Function to check for conversation context (see context_index.build_context)
+def has_conversation_context(event_body):
+    context = event_body.get("context")
+    if isinstance(context, dict):
+        return any(context.values())
+    return bool(context)
+
+
+# ✅ Function to decide whether a message may be served from / stored in the cache
+def is_cacheable(event_body):
+    """ Cached replies are shared by all users, so the reply must not depend on who is asking """
+    message = event_body.get("message")
+    if not RESPONSE_CACHE_ENABLED or not ALLOWLIST_PATTERNS or event_body.get("no_cache") or not isinstance(message, str):
+        return False
+    if has_conversation_context(event_body):
+        return False
+    normalized = normalize_message(message)
+    if not normalized or len(normalized) > MAX_CACHEABLE_MESSAGE_CHARS:
+        return False
+    if PERSONAL_PATTERN.search(message.lower()) or AUTOMATION_PATTERN.search(normalized):
+        return False
+    return any(p.search(normalized) for p in ALLOWLIST_PATTERNS)
+
+
+# ✅ Function to build the cache key from normalized text and answer-relevant context
+def cache_key_for(event_body):
+    context = {field: event_body.get(field) for field in CONTEXT_FIELDS if event_body.get(field) is not None}
+    raw = normalize_message(event_body["message"]) + "|" + json.dumps(context, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """ ✅ In-process LRU bounded by total bytes, with per-entry expiry """
+
+    def __init__(self, max_bytes=MEMORY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, expires_at):
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.size -= entry[1]
+
+
+memory_cache = MemoryLRU()
+stats = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "errors": 0}
+
+
+# ✅ Function to look up a reply: memory first, then the shared DynamoDB tier
+def get_response(key):
+    response = memory_cache.get(key)
+    if response is not None:
+        stats["memory_hits"] += 1
+        return response
+
+    try:
+        item = cache_table.get_item(Key={"cache_key": key}).get("Item")
+    except Exception as e:
+        logger.warning("Response cache read failed: %s", e)
+        stats["errors"] += 1
+        item = None
+    # ✅ DynamoDB TTL deletes lazily, so check expiry ourselves
+    if item and int(item.get("expires_at", 0)) > time.time():
+        stats["shared_hits"] += 1
+        memory_cache.put(key, item["response"], min(int(item["expires_at"]), time.time() + MEMORY_TTL_SECONDS))
+        return item["response"]
+
+    stats["misses"] += 1
+    return None
+
+
+# ✅ Function to store a reply in both tiers
+def put_response(key, response):
+    now = int(time.time())
+    memory_cache.put(key, response, now + MEMORY_TTL_SECONDS)
+    try:
+        cache_table.put_item(Item={"cache_key": key, "response": response, "expires_at": now + SHARED_TTL_SECONDS})
+        stats["stores"] += 1
+    except Exception as e:
+        logger.warning("Response cache write failed: %s", e)
+        stats["errors"] += 1
+
+
+def record_bypass():
+    stats["bypassed"] += 1
+
+
+def get_stats():
+    lookups = stats["memory_hits"] + stats["shared_hits"] + stats["misses"]
+    hits = stats["memory_hits"] + stats["shared_hits"]
+    return dict(stats, hit_rate=round(hits / lookups, 4) if lookups else 0.0, memory_bytes=memory_cache.size)
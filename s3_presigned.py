@@ -1,14 +1,18 @@
-import boto3
 import os
-from datetime import datetime
+import math
+import time
+import audit_log
+import file_index
+from urllib.parse import unquote_plus
+from aws_clients import lazy_client
+from instrumentation import instrument, timed, record_error
+from collections import OrderedDict
 
-# ✅ Initialize S3 Client
-s3_client = boto3.client('s3')
+# ✅ S3 Client (created on first use); SigV4 so signed ContentLength limits are enforced by S3
+s3_client = lazy_client('s3', signature_version='s3v4')
 
 # ✅ Environment Variables (Placeholders for Security)
 BUCKET_NAME = os.getenv('BUCKET_NAME', '<S3_BUCKET_NAME>')
-AUDIT_BUCKET_NAME = os.getenv('AUDIT_BUCKET_NAME', '<AUDIT_LOG_BUCKET>')
-AUDIT_LOG_KEY = 'audit_logs.txt'
 
 # ✅ Disallowed file extensions for security
 DISALLOWED_EXTENSIONS = {'.exe', '.bat', '.cmd', '.sh', '.bin', '.js', '.vbs', '.ps1', '.py', '.rb', '.pl', '.html', '.htm', '.php', '.asp', '.aspx', '.dll', '.sys', '.drv'}
@@ -16,64 +20,336 @@ DISALLOWED_EXTENSIONS = {'.exe', '.bat', '.cmd', '.sh', '.bin', '.js', '.vbs', '
 # ✅ Max file size limit (4GB)
 MAX_FILE_SIZE = 4 * 1024 * 1024 * 1024  # 4GB in bytes
 
+# ✅ Multipart upload settings
+URL_EXPIRES_IN = 3600
+MIN_PART_SIZE = 8 * 1024 * 1024  # S3 minimum is 5MB; 8MB keeps part counts low
+MAX_PARTS_PER_UPLOAD = 1000  # Every part URL fits in a single response
+MULTIPART_STEPS = {'start', 'sign', 'complete', 'abort'}
+SIZED_MULTIPART_STEPS = {'start', 'sign', 'complete'}  # Steps that take file_size and are checked against the quota
+
+# ✅ Batch presigning and warm-container URL memo
+MAX_BATCH_FILES = 100
+BATCH_ACTIONS = {'upload', 'delete'}
+PRESIGN_MEMO_MIN_REMAINING = 900  # Only reuse a URL with at least 15 minutes left
+PRESIGN_MEMO_MAX_ENTRIES = 2048
+presign_memo = OrderedDict()
+
 # ✅ Main Lambda Handler
+@instrument
 def lambda_handler(event, context):
+    # ✅ S3 object events keep the per-user file index in sync
+    if event.get('Records') and event['Records'][0].get('eventSource') == 'aws:s3':
+        return handle_s3_event(event)
+    try:
+        return handle_request(event)
+    finally:
+        # ✅ Write buffered audit entries before the container is frozen
+        audit_log.flush()
+
+# ✅ Handles one presign request
+def handle_request(event):
     user_id = event.get('user_id')
     filename = event.get('filename')
     action = event.get('action', 'upload')
     file_size = event.get('file_size', 0)
     user_role = event.get('role', 'free')
 
-    # ✅ Validate file extension
-    if any(filename.endswith(ext) for ext in DISALLOWED_EXTENSIONS):
-        return {"statusCode": 400, "body": {"error": "File type not allowed."}}
-    
     # ✅ Validate user role
     if user_role not in ['owner', 'subscriber', 'free']:
         return {"statusCode": 403, "body": {"error": "Forbidden: Invalid user role"}}
-    
-    # ✅ Enforce max file size for uploads
-    if action == 'upload' and file_size > MAX_FILE_SIZE:
-        return {"statusCode": 400, "body": {"error": "File size exceeds the 4GB limit."}}
+
+    # ✅ Batch mode: {"files": [{"filename", "action", "file_size"}, ...]}
+    if 'files' in event:
+        return handle_batch(user_id, user_role, event.get('files'))
+
+    # ✅ List files from the index: {"action": "list", "limit", "cursor", "sort", "order"}
+    if action == 'list':
+        return handle_list(event, user_id)
+
+    error = validate_file(filename, action, file_size)
+    if error:
+        return {"statusCode": 400, "body": {"error": error}}
+
+    # ✅ Refuse uploads that would exceed the role's storage quota
+    if action == 'upload' or (action == 'multipart' and event.get('step', 'start') in SIZED_MULTIPART_STEPS):
+        quota_error = file_index.check_quota(user_id, user_role, filename, file_size, seed=stored_files(user_id))
+        if quota_error:
+            return {"statusCode": 403, "body": {"error": quota_error}}
+
+    # ✅ Multipart uploads (large files, parallel and resumable parts)
+    if action == 'multipart':
+        return handle_multipart(event, user_id, filename, file_size)
     
     # ✅ Log action to S3 Audit Log
     log_to_s3(user_id, action, filename)
     
     # ✅ Generate Pre-Signed URL
-    presigned_url = generate_presigned_url(action, user_id, filename, file_size)
+    presigned_url, expires_in = presign(action, user_id, filename, file_size)
     if not presigned_url:
         return {"statusCode": 400, "body": {"error": "Invalid action specified."}}
     
-    return {"statusCode": 200, "body": {"presigned_url": presigned_url, "expires_in": 3600}}
+    return {"statusCode": 200, "body": {"presigned_url": presigned_url, "expires_in": expires_in}}
+
+# ✅ Function to validate one file request; returns an error message or None
+def validate_file(filename, action, file_size):
+    # ✅ Validate file extension
+    if not isinstance(filename, str) or not filename:
+        return "Missing filename."
+    if any(filename.endswith(ext) for ext in DISALLOWED_EXTENSIONS):
+        return "File type not allowed."
+
+    # ✅ Enforce a whole, non-negative byte count and the max file size for uploads
+    if action in ('upload', 'multipart'):
+        if not isinstance(file_size, int) or isinstance(file_size, bool) or file_size < 0:
+            return "file_size must be a non-negative integer."
+        if file_size > MAX_FILE_SIZE:
+            return "File size exceeds the 4GB limit."
+    return None
+
+# ✅ Batch Handler: validates every entry first, then returns all URLs in one response
+def handle_batch(user_id, user_role, files):
+    if not isinstance(files, list) or not files:
+        return {"statusCode": 400, "body": {"error": "files must be a non-empty list."}}
+    if len(files) > MAX_BATCH_FILES:
+        return {"statusCode": 400, "body": {"error": f"At most {MAX_BATCH_FILES} files per batch."}}
+
+    errors = []
+    upload_sizes = []
+    for index, entry in enumerate(files):
+        entry = entry if isinstance(entry, dict) else {}
+        action = entry.get('action', 'upload')
+        error = validate_file(entry.get('filename'), action, entry.get('file_size', 0))
+        if not error and action not in BATCH_ACTIONS:
+            error = "Invalid action specified."
+        if error:
+            errors.append({"index": index, "filename": entry.get('filename'), "error": error})
+        elif action == 'upload':
+            upload_sizes.append(entry.get('file_size', 0))
+    if errors:
+        return {"statusCode": 400, "body": {"errors": errors}}
+
+    # ✅ Only validated (non-negative) sizes are summed, so entries cannot offset each other
+    if any(upload_sizes):
+        quota_error = file_index.check_batch_quota(user_id, user_role, upload_sizes, seed=stored_files(user_id))
+        if quota_error:
+            return {"statusCode": 403, "body": {"error": quota_error}}
+
+    results = []
+    for entry in files:
+        action = entry.get('action', 'upload')
+        log_to_s3(user_id, action, entry['filename'])
+        presigned_url, expires_in = presign(action, user_id, entry['filename'], entry.get('file_size', 0))
+        if not presigned_url:
+            return {"statusCode": 500, "body": {"error": f"Could not presign {entry['filename']}."}}
+        results.append({
+            "filename": entry['filename'],
+            "action": action,
+            "presigned_url": presigned_url,
+            "expires_in": expires_in
+        })
+    return {"statusCode": 200, "body": {"files": results}}
+
+# ✅ List Handler: paginated, sorted listing straight from the file index
+def handle_list(event, user_id):
+    try:
+        files, next_cursor = file_index.list_files(
+            user_id,
+            limit=event.get('limit', file_index.DEFAULT_PAGE_SIZE),
+            cursor=event.get('cursor'),
+            sort=event.get('sort', 'name'),
+            order=event.get('order', 'asc'),
+            seed=stored_files(user_id)
+        )
+    except (TypeError, ValueError):
+        return {"statusCode": 400, "body": {"error": "Invalid list request."}}
+    return {"statusCode": 200, "body": {"files": files, "next_cursor": next_cursor}}
+
+# ✅ S3 Event Handler: ObjectCreated / ObjectRemoved under UserData/{user_id}/
+def handle_s3_event(event):
+    for record in event['Records']:
+        object_info = record['s3']['object']
+        parts = unquote_plus(object_info['key']).split('/', 2)
+        if len(parts) != 3 or parts[0] != 'UserData' or not parts[2]:
+            continue
+        _, user_id, filename = parts
+        if record['eventName'].startswith('ObjectCreated'):
+            file_index.record_file(user_id, filename, int(object_info.get('size', 0)), record.get('eventTime'))
+        elif record['eventName'].startswith('ObjectRemoved'):
+            file_index.remove_file(user_id, filename)
+    return {"statusCode": 200, "body": {"processed": len(event['Records'])}}
+
+# ✅ Function to list a user's stored objects, used once to seed the file index for files uploaded before it existed
+def stored_files(user_id):
+    prefix = f'UserData/{user_id}/'
 
-# ✅ Function to log user actions in S3 Audit Log
+    def seed():
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                filename = obj['Key'][len(prefix):]
+                if filename:
+                    yield filename, int(obj['Size']), obj['LastModified'].isoformat()
+    return seed
+
+# ✅ Function to presign with the warm-container memo; returns (url, seconds_remaining)
+def presign(action, user_id, filename, file_size=0):
+    memo_key = (action, f'UserData/{user_id}/{filename}', file_size)
+    now = time.time()
+    cached = presign_memo.get(memo_key)
+    if cached and cached[1] - now >= PRESIGN_MEMO_MIN_REMAINING:
+        presign_memo.move_to_end(memo_key)
+        return cached[0], int(cached[1] - now)
+
+    presigned_url = generate_presigned_url(action, user_id, filename, file_size)
+    if not presigned_url:
+        return None, 0
+    presign_memo[memo_key] = (presigned_url, now + URL_EXPIRES_IN)
+    presign_memo.move_to_end(memo_key)
+    while len(presign_memo) > PRESIGN_MEMO_MAX_ENTRIES:
+        presign_memo.popitem(last=False)
+    return presigned_url, URL_EXPIRES_IN
+
+# ✅ Function to log user actions in S3 Audit Log (buffered, see audit_log.py)
 def log_to_s3(user_id, action, filename):
-    log_entry = f"User: {user_id}, Action: {action}, File: {filename}, Timestamp: {datetime.now().isoformat()}\n"
-    s3_client.put_object(
-        Bucket=AUDIT_BUCKET_NAME,
-        Key=AUDIT_LOG_KEY,
-        Body=log_entry.encode('utf-8'),
-        ContentType='text/plain'
-    )
+    audit_log.record(user_id, action, filename)
 
 # ✅ Function to generate Pre-Signed URLs
 def generate_presigned_url(action, user_id, filename, file_size=0):
     object_key = f'UserData/{user_id}/{filename}'
     
     try:
-        if action == 'upload':
-            return s3_client.generate_presigned_url(
-                'put_object',
-                Params={'Bucket': BUCKET_NAME, 'Key': object_key, 'ContentLength': file_size},
-                ExpiresIn=3600
-            )
-        elif action == 'delete':
-            return s3_client.generate_presigned_url(
-                'delete_object',
-                Params={'Bucket': BUCKET_NAME, 'Key': object_key},
-                ExpiresIn=3600
-            )
-        else:
-            return None
+        with timed('s3', 'generate_presigned_url'):
+            if action == 'upload':
+                return s3_client.generate_presigned_url(
+                    'put_object',
+                    Params={'Bucket': BUCKET_NAME, 'Key': object_key, 'ContentLength': file_size},
+                    ExpiresIn=URL_EXPIRES_IN
+                )
+            elif action == 'delete':
+                return s3_client.generate_presigned_url(
+                    'delete_object',
+                    Params={'Bucket': BUCKET_NAME, 'Key': object_key},
+                    ExpiresIn=URL_EXPIRES_IN
+                )
+            else:
+                return None
     except Exception:
         return None
+
+# ✅ Function to choose a part size that keeps the upload within MAX_PARTS_PER_UPLOAD parts
+def choose_part_size(file_size):
+    mib = 1024 * 1024
+    part_size = max(MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS_PER_UPLOAD))
+    return math.ceil(part_size / mib) * mib
+
+# ✅ Function to derive the part layout from the declared file size: (part_size, part_count)
+def part_layout(file_size):
+    part_size = choose_part_size(file_size)
+    return part_size, math.ceil(file_size / part_size)
+
+# ✅ Function to get one part's exact length (the last part gets the remainder)
+def part_length(file_size, part_size, part_number):
+    return min(part_size, file_size - part_size * (part_number - 1))
+
+# ✅ Function to presign upload_part URLs for a batch of part numbers (each URL only accepts its exact length)
+def presign_parts(object_key, upload_id, part_numbers, file_size):
+    part_size, _ = part_layout(file_size)
+    with timed('s3', 'generate_presigned_url'):
+        return [
+            {
+                'part_number': part_number,
+                'url': s3_client.generate_presigned_url(
+                    'upload_part',
+                    Params={
+                        'Bucket': BUCKET_NAME,
+                        'Key': object_key,
+                        'UploadId': upload_id,
+                        'PartNumber': part_number,
+                        'ContentLength': part_length(file_size, part_size, part_number)
+                    },
+                    ExpiresIn=URL_EXPIRES_IN
+                )
+            }
+            for part_number in part_numbers
+        ]
+
+# ✅ Function to sum the sizes of the parts S3 actually received
+def uploaded_size(object_key, upload_id):
+    total = 0
+    kwargs = {'Bucket': BUCKET_NAME, 'Key': object_key, 'UploadId': upload_id}
+    while True:
+        response = s3_client.list_parts(**kwargs)
+        total += sum(part['Size'] for part in response.get('Parts', []))
+        if not response.get('IsTruncated'):
+            return total
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+# ✅ Multipart Upload Handler: step = start | sign | complete | abort
+def handle_multipart(event, user_id, filename, file_size):
+    step = event.get('step', 'start')
+    upload_id = event.get('upload_id')
+    object_key = f'UserData/{user_id}/{filename}'
+
+    if step not in MULTIPART_STEPS:
+        return {"statusCode": 400, "body": {"error": "Invalid multipart step specified."}}
+    if step != 'start' and not upload_id:
+        return {"statusCode": 400, "body": {"error": "Missing upload_id."}}
+
+    if step in SIZED_MULTIPART_STEPS and (not isinstance(file_size, int) or file_size <= 0):
+        return {"statusCode": 400, "body": {"error": "file_size is required for multipart uploads."}}
+
+    log_to_s3(user_id, f'multipart_{step}', filename)
+
+    try:
+        if step in SIZED_MULTIPART_STEPS:
+            part_size, part_count = part_layout(file_size)
+
+        if step == 'start':
+            upload_id = s3_client.create_multipart_upload(Bucket=BUCKET_NAME, Key=object_key)['UploadId']
+            return {"statusCode": 200, "body": {
+                "upload_id": upload_id,
+                "part_size": part_size,
+                "part_count": part_count,
+                "parts": presign_parts(object_key, upload_id, range(1, part_count + 1), file_size),
+                "expires_in": URL_EXPIRES_IN
+            }}
+
+        if step == 'sign':
+            # ✅ Re-sign specific parts to resume a failed or expired upload
+            part_numbers = sorted({int(n) for n in event.get('part_numbers', [])})
+            if not part_numbers or part_numbers[0] < 1 or part_numbers[-1] > part_count:
+                return {"statusCode": 400, "body": {"error": "Invalid part_numbers."}}
+            return {"statusCode": 200, "body": {
+                "upload_id": upload_id,
+                "parts": presign_parts(object_key, upload_id, part_numbers, file_size),
+                "expires_in": URL_EXPIRES_IN
+            }}
+
+        if step == 'complete':
+            parts = sorted(
+                ({'PartNumber': int(p.get('part_number', p.get('PartNumber'))), 'ETag': p.get('etag', p.get('ETag'))}
+                 for p in event.get('parts', [])),
+                key=lambda p: p['PartNumber']
+            )
+            if not parts or any(not p['ETag'] for p in parts):
+                return {"statusCode": 400, "body": {"error": "Missing part ETags."}}
+            if parts[0]['PartNumber'] < 1 or parts[-1]['PartNumber'] > part_count:
+                return {"statusCode": 400, "body": {"error": "Invalid part numbers."}}
+            # ✅ The assembled object may not exceed the declared (quota-checked) size
+            if uploaded_size(object_key, upload_id) > file_size:
+                return {"statusCode": 400, "body": {"error": "Uploaded parts exceed the declared file_size."}}
+            result = s3_client.complete_multipart_upload(
+                Bucket=BUCKET_NAME,
+                Key=object_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+            return {"statusCode": 200, "body": {"key": object_key, "etag": result.get('ETag')}}
+
+        s3_client.abort_multipart_upload(Bucket=BUCKET_NAME, Key=object_key, UploadId=upload_id)
+        return {"statusCode": 200, "body": {"aborted": True}}
+    except (TypeError, ValueError):
+        return {"statusCode": 400, "body": {"error": "Invalid multipart request."}}
+    except Exception as e:
+        record_error(e)
+        return {"statusCode": 500, "body": {"error": "Multipart request failed."}}
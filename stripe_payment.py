@@ -1,17 +1,24 @@
 import json
-import boto3
+import time
+import hashlib
 import stripe
 import os
+import plan_catalog
+from instrumentation import instrument, timed, record_error
 
 # ✅ Load environment variables (Placeholders for security)
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "<STRIPE_SECRET>")
 STRIPE_SUCCESS_URL = os.getenv("STRIPE_SUCCESS_URL", "<SUCCESS_URL>")
 STRIPE_CANCEL_URL = os.getenv("STRIPE_CANCEL_URL", "<CANCEL_URL>")
+IDEMPOTENCY_WINDOW_SECONDS = 10 * 60  # Repeat clicks in this window get the same session
 
-# ✅ Initialize Stripe API Key
+# ✅ Initialize Stripe API Key and one pooled HTTP client for the container
 stripe.api_key = STRIPE_SECRET_KEY
+stripe.default_http_client = stripe.RequestsClient(timeout=10)
+stripe.max_network_retries = 2  # Safe: every create call carries an idempotency key
 
 # ✅ Main Lambda Handler
+@instrument
 def lambda_handler(event, context):
     """ ✅ Handles Stripe Checkout Session Creation """
     try:
@@ -23,33 +30,46 @@ def lambda_handler(event, context):
         user_id = body.get("user_id")
         plan = body.get("plan", "pro")  # Default to "pro" plan
 
-        if not user_id:
+        if not user_id or not isinstance(user_id, str):
             return generate_response(400, {"error": "Missing user_id"})
+        if not isinstance(plan, str) or not plan:
+            return generate_response(400, {"error": "Invalid plan"})
+
+        # ✅ Resolve the plan to a preloaded Stripe Price
+        plan_info = plan_catalog.get_plan(plan)
+        if not plan_info:
+            if plan_catalog.is_unavailable(plan):
+                # ✅ Stripe could not be reached for this price; the catalog retries shortly
+                return generate_response(503, {"error": "Plan temporarily unavailable"})
+            return generate_response(400, {"error": "Unknown plan"})
+        plan = plan.lower()
 
         # ✅ Create Stripe Checkout Session
-        session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            mode="subscription",
-            line_items=[{
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": "TaskSensei Subscription",
-                        "description": f"{plan.capitalize()} Plan Subscription",
-                    },
-                    "unit_amount": 3900,  # $39.00 in cents
-                    "recurring": {"interval": "month"}
-                },
-                "quantity": 1
-            }],
-            success_url=f"{STRIPE_SUCCESS_URL}?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=STRIPE_CANCEL_URL
-        )
+        metadata = {"user_id": user_id, "plan": plan}
+        with timed("stripe", "checkout.Session.create"):
+            session = stripe.checkout.Session.create(
+                payment_method_types=["card"],
+                mode="subscription",
+                line_items=[{"price": plan_info["price_id"], "quantity": 1}],
+                client_reference_id=user_id,
+                metadata=metadata,
+                subscription_data={"metadata": metadata},
+                success_url=f"{STRIPE_SUCCESS_URL}?session_id={{CHECKOUT_SESSION_ID}}",
+                cancel_url=STRIPE_CANCEL_URL,
+                idempotency_key=checkout_idempotency_key(user_id, plan, plan_info["price_id"])
+            )
 
         return generate_response(200, {"sessionId": session.id})
-    except Exception:
+    except Exception as e:
+        record_error(e)
         return generate_response(500, {"error": "Internal Server Error"})
 
+# ✅ Function to derive an idempotency key so double-clicks reuse one Checkout Session
+def checkout_idempotency_key(user_id, plan, price_id):
+    window = int(time.time() // IDEMPOTENCY_WINDOW_SECONDS)
+    digest = hashlib.sha256(f"{user_id}|{plan}|{price_id}|{window}".encode("utf-8")).hexdigest()
+    return f"checkout-{digest}"
+
 # ✅ Helper Function: Generates API Gateway Response with CORS
 def generate_response(status_code, body):
     return {
@@ -1,44 +1,225 @@
 import json
-import boto3
 import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+from decimal import Decimal
+from aws_clients import lazy_client, lazy_resource, lazy_table
+import profile_cache
+from instrumentation import instrument, record_error
 
-# ✅ Initialize AWS Clients
-dynamodb = boto3.resource("dynamodb")
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ AWS Clients (created on first use)
+dynamodb = lazy_resource("dynamodb")
+sqs_client = lazy_client("sqs")
 
 # ✅ Environment Variables (Placeholders for Security)
 TABLE_NAME = os.getenv("DYNAMODB_TABLE_NAME", "<DYNAMODB_USERS_TABLE>")
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "<STRIPE_WEBHOOK_SECRET>")
+# Dedupe table: PK event_id, status (pending -> queued), TTL attribute expires_at.
+# Stripe retries deliveries for up to 3 days.
+STRIPE_EVENTS_TABLE_NAME = os.getenv("STRIPE_EVENTS_TABLE_NAME", "<DYNAMODB_STRIPE_EVENTS_TABLE>")
+# FIFO queue (MessageGroupId = user) so each user's events reach the processor in order
+STRIPE_EVENTS_QUEUE_URL = os.getenv("STRIPE_EVENTS_QUEUE_URL", "<SQS_STRIPE_EVENTS_QUEUE_URL>")
+EVENT_DEDUPE_TTL_SECONDS = 7 * 24 * 60 * 60
+SIGNATURE_TOLERANCE_SECONDS = 300
+
+events_table = lazy_table(STRIPE_EVENTS_TABLE_NAME)
+
+# ✅ Events that change a user's subscription (everything else is acked and dropped)
+SUBSCRIPTION_EVENTS = ("checkout.session.completed", "customer.subscription.updated", "customer.subscription.deleted")
 
 # ✅ Main Lambda Handler
+@instrument
 def lambda_handler(event, context):
-    """ ✅ Handles Stripe Webhook Events """
+    """ ✅ Handles Stripe Webhook Events (ack path) and queued events (SQS processor) """
+    if event.get("Records") and event["Records"][0].get("eventSource") == "aws:sqs":
+        return handle_queued_events(event)
     try:
-        # ✅ Extract event type directly (NO "body" field in Stripe webhook)
-        event_type = event.get("type", "unknown")
-        data_object = event.get("data", {}).get("object", {})
+        # ✅ Every event must carry a valid Stripe-Signature; unsigned direct invocations are rejected
+        if not event.get("body"):
+            return generate_response(400, {"error": "Missing body"})
+        stripe_event, error = verify_stripe_event(event)
+        if error:
+            return generate_response(400, {"error": error})
+        return acknowledge_event(stripe_event)
+    except Exception as e:
+        record_error(e)
+        return generate_response(500, {"error": "Internal Server Error"})
+
+# ✅ Function to verify the Stripe-Signature header (same scheme as stripe.Webhook.construct_event)
+def verify_stripe_event(event):
+    payload = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        payload = base64.b64decode(payload).decode("utf-8")
+    headers = {key.lower(): value for key, value in (event.get("headers") or {}).items()}
+    signature_header = headers.get("stripe-signature", "")
 
-        # ✅ Extract necessary details
-        metadata = data_object.get("metadata", {})
-        user_id = metadata.get("user_id", "unknown_user")
-        plan = metadata.get("plan", "unknown_plan")
-        payment_status = data_object.get("status", "unpaid")
+    timestamp, signatures = None, []
+    for part in signature_header.split(","):
+        key, _, value = part.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+    if not timestamp or not signatures:
+        return None, "Missing signature"
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > SIGNATURE_TOLERANCE_SECONDS:
+        return None, "Signature timestamp outside tolerance"
 
-        # ✅ Handle successful checkout session
-        if event_type == "checkout.session.completed" and payment_status == "paid":
-            update_subscription_status(user_id, plan)
+    expected = hmac.new(STRIPE_WEBHOOK_SECRET.encode("utf-8"), f"{timestamp}.{payload}".encode("utf-8"), hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        return None, "Invalid signature"
+    return json.loads(payload), None
 
-        return generate_response(200, {"message": "Webhook processed successfully"})
+# ✅ Function to pick the user an event belongs to (set by stripe_payment on the session and subscription)
+def get_event_user(data_object):
+    metadata = data_object.get("metadata") or {}
+    subscription_metadata = (data_object.get("subscription_details") or {}).get("metadata") or {}
+    return metadata.get("user_id") or data_object.get("client_reference_id") or subscription_metadata.get("user_id")
+
+# ✅ Function to ack fast: claim the event ID, queue it, mark it queued, return 200
+def acknowledge_event(stripe_event):
+    """ ✅ Only "queued" events count as duplicates, so a delivery cut off before the send is retried """
+    event_id = stripe_event.get("id")
+    event_type = stripe_event.get("type", "unknown")
+    if not event_id:
+        return generate_response(400, {"error": "Missing event id"})
+    if event_type not in SUBSCRIPTION_EVENTS:
+        return generate_response(200, {"message": "Event ignored"})
+
+    now = int(time.time())
+    try:
+        events_table.put_item(
+            Item={
+                "event_id": event_id,
+                "type": event_type,
+                "status": "pending",
+                "received_at": now,
+                "expires_at": now + EVENT_DEDUPE_TTL_SECONDS
+            },
+            ConditionExpression="attribute_not_exists(event_id) OR #status = :pending",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={":pending": "pending"}
+        )
+    except events_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return generate_response(200, {"message": "Duplicate event"})
+
+    data_object = stripe_event.get("data", {}).get("object", {})
+    message = {
+        "id": event_id,
+        "type": event_type,
+        "created": stripe_event.get("created", now),
+        "user_id": get_event_user(data_object),
+        "object": data_object
+    }
+    try:
+        send_kwargs = {"QueueUrl": STRIPE_EVENTS_QUEUE_URL, "MessageBody": json.dumps(message)}
+        if STRIPE_EVENTS_QUEUE_URL.endswith(".fifo"):
+            send_kwargs["MessageGroupId"] = message["user_id"] or data_object.get("customer") or "unknown_user"
+            send_kwargs["MessageDeduplicationId"] = event_id
+        sqs_client.send_message(**send_kwargs)
     except Exception:
-        return generate_response(500, {"error": "Internal Server Error"})
+        # ✅ Forget the event so Stripe's retry is not mistaken for a duplicate (a leftover "pending" is retried too)
+        try:
+            events_table.delete_item(Key={"event_id": event_id})
+        except Exception as e:
+            logger.warning("Failed to release Stripe event %s: %s", event_id, e)
+        raise
+    # ✅ A second delivery racing this one may queue it again; the processor's conditional write makes that harmless
+    events_table.update_item(
+        Key={"event_id": event_id},
+        UpdateExpression="SET #status = :queued",
+        ExpressionAttributeNames={"#status": "status"},
+        ExpressionAttributeValues={":queued": "queued"}
+    )
+    return generate_response(200, {"message": "Webhook received"})
+
+# ✅ Function to turn one queued event into the subscription fields it sets (None if it sets nothing)
+def subscription_change(message):
+    data_object = message.get("object", {})
+    metadata = data_object.get("metadata", {})
+    if message["type"] == "checkout.session.completed":
+        # ✅ Checkout Sessions report payment_status; older payloads used status
+        if "paid" not in (data_object.get("payment_status"), data_object.get("status")):
+            return None
+        return {"plan": metadata.get("plan", "unknown_plan"), "payment_status": "active"}
+    if message["type"] == "customer.subscription.updated":
+        change = {"payment_status": data_object.get("status", "unknown")}
+        if metadata.get("plan"):
+            change["plan"] = metadata["plan"]
+        return change
+    if message["type"] == "customer.subscription.deleted":
+        return {"payment_status": "canceled"}
+    return None
+
+# ✅ SQS processor: one ordered write per user per batch
+def handle_queued_events(event):
+    """ ✅ Returns batchItemFailures so only failed users' messages are retried """
+    by_user = {}
+    failures = []
+    for position, record in enumerate(event["Records"]):
+        try:
+            message = json.loads(record["body"])
+        except ValueError:
+            logger.error("Dropping malformed Stripe event message %s", record.get("messageId"))
+            continue
+        if not message.get("user_id"):
+            logger.warning("Stripe event %s (%s) has no user_id; skipping", message.get("id"), message.get("type"))
+            continue
+        by_user.setdefault(message["user_id"], []).append((position, record["messageId"], message))
+
+    for user_id, entries in by_user.items():
+        ordered = sorted(entries, key=lambda entry: (entry[2].get("created", 0), entry[0]))
+        if [entry[0] for entry in ordered] != [entry[0] for entry in entries]:
+            logger.warning("Out-of-order Stripe events for %s: received %s, applying %s", user_id,
+                           [entry[2]["type"] for entry in entries], [entry[2]["type"] for entry in ordered])
+        try:
+            apply_subscription_events(user_id, [entry[2] for entry in ordered])
+        except Exception as e:
+            logger.error("Failed to apply Stripe events for %s: %s", user_id, e)
+            failures.extend({"itemIdentifier": entry[1]} for entry in entries)
+    return {"batchItemFailures": failures}
+
+# ✅ Function to fold a user's events (oldest first) into one conditional write
+def apply_subscription_events(user_id, messages):
+    """ ✅ Skips the write if a newer Stripe event was already applied; returns True if written.
+    The same write stamps the profile_cache marker, so cached login profiles are dropped without an extra request. """
+    changes = {}
+    latest = None
+    for message in messages:
+        change = subscription_change(message)
+        if change:
+            changes.update(change)
+            latest = message
+    if not latest:
+        return False
 
-# ✅ Function to update user subscription in DynamoDB
-def update_subscription_status(user_id, plan):
-    """ ✅ Updates subscription plan and payment status in DynamoDB. """
     table = dynamodb.Table(TABLE_NAME)
-    table.update_item(
-        Key={"TS_user_id": user_id},
-        UpdateExpression="SET plan = :plan, payment_status = :status",
-        ExpressionAttributeValues={":plan": plan, ":status": "active"}
-    )
+    names = {f"#f{i}": field for i, field in enumerate(changes)}
+    values = {f":v{i}": value for i, value in enumerate(changes.values())}
+    try:
+        table.update_item(
+            Key={"TS_user_id": user_id},
+            UpdateExpression="SET " + ", ".join(f"#f{i} = :v{i}" for i in range(len(changes)))
+                             + ", stripe_event_created = :created, stripe_event_id = :event_id, "
+                             + f"{profile_cache.INVALIDATED_AT_ATTRIBUTE} = :invalidated_at",
+            ConditionExpression="attribute_not_exists(stripe_event_created) OR stripe_event_created <= :created",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={
+                **values, ":created": int(latest["created"]), ":event_id": latest["id"],
+                ":invalidated_at": Decimal(str(time.time()))
+            }
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.warning("Out-of-order Stripe event %s (%s) for %s is older than the applied state; skipped",
+                       latest["id"], latest["type"], user_id)
+        return False
+    return True
 
 # ✅ Helper Function: Generates API Gateway Response
 def generate_response(status_code, body):
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from aws_clients import lazy_table
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ Coalescing Settings (Placeholders for Security)
+# Simultaneous refreshes from several tabs land on different containers, so they are coalesced through a
+# shared DynamoDB tier: PK token_hash (SHA-256 of the refresh token), attributes sealed, lease_expires and
+# TTL attribute expires_at. The first caller takes a short conditional lease and calls Cognito; the others
+# wait for its result. The result is stored only as AES-GCM ciphertext under a key derived (HKDF) from the
+# refresh token, so the table holds nothing usable without that refresh token.
+# The window is short because a revoked refresh token can still be answered from here until it ends.
+TOKEN_REFRESH_TABLE_NAME = os.getenv("TOKEN_REFRESH_TABLE_NAME", "<DYNAMODB_TOKEN_REFRESH_TABLE>")
+REUSE_WINDOW_SECONDS = 60  # Hand out an access token issued within this window...
+MIN_REMAINING_SECONDS = 120  # ...as long as it stays valid at least this long
+LEASE_SECONDS = 5  # How long one container may hold the right to call Cognito
+POLL_INTERVAL_SECONDS = 0.1
+SEAL_KEY_INFO = b"tasksensei/token-refresh/v1"
+NONCE_BYTES = 12
+
+refresh_table = lazy_table(TOKEN_REFRESH_TABLE_NAME)
+
+# ✅ Warm-container state: recent results per token hash
+recent_tokens = {}
+
+
+def hash_refresh_token(refresh_token):
+    return hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()
+
+
+def is_reusable(entry, now=None):
+    now = now or time.time()
+    return bool(entry) and now - entry["issued_at"] <= REUSE_WINDOW_SECONDS and entry["expires_at"] - now >= MIN_REMAINING_SECONDS
+
+
+# ✅ Sealing: only a caller holding the refresh token can derive the key; the token hash is bound as AAD
+def derive_key(refresh_token):
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=SEAL_KEY_INFO).derive(refresh_token.encode("utf-8"))
+
+
+def seal(refresh_token, token_hash, entry):
+    nonce = os.urandom(NONCE_BYTES)
+    plaintext = json.dumps(entry).encode("utf-8")
+    return nonce + AESGCM(derive_key(refresh_token)).encrypt(nonce, plaintext, token_hash.encode("ascii"))
+
+
+def unseal(refresh_token, token_hash, sealed):
+    try:
+        plaintext = AESGCM(derive_key(refresh_token)).decrypt(
+            sealed[:NONCE_BYTES], sealed[NONCE_BYTES:], token_hash.encode("ascii")
+        )
+    except (InvalidTag, ValueError):
+        return None
+    return json.loads(plaintext)
+
+
+# ✅ Shared tier helpers
+def read_shared(refresh_token, token_hash):
+    item = refresh_table.get_item(Key={"token_hash": token_hash}, ConsistentRead=True).get("Item")
+    if not item or "sealed" not in item:
+        return None
+    return unseal(refresh_token, token_hash, bytes(item["sealed"]))
+
+
+def acquire_lease(token_hash):
+    now = int(time.time())
+    try:
+        refresh_table.update_item(
+            Key={"token_hash": token_hash},
+            UpdateExpression="SET lease_expires = :lease, expires_at = :ttl",
+            ConditionExpression="attribute_not_exists(lease_expires) OR lease_expires < :now",
+            ExpressionAttributeValues={":lease": now + LEASE_SECONDS, ":ttl": now + REUSE_WINDOW_SECONDS, ":now": now}
+        )
+        return True
+    except refresh_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def store_shared(refresh_token, token_hash, entry):
+    refresh_table.put_item(Item={
+        "token_hash": token_hash,
+        "sealed": seal(refresh_token, token_hash, entry),
+        "lease_expires": 0,
+        "expires_at": int(entry["issued_at"]) + REUSE_WINDOW_SECONDS
+    })
+
+
+def release_lease(token_hash):
+    try:
+        refresh_table.update_item(
+            Key={"token_hash": token_hash},
+            UpdateExpression="SET lease_expires = :zero",
+            ExpressionAttributeValues={":zero": 0}
+        )
+    except Exception as e:
+        logger.warning("Failed to release refresh lease: %s", e)
+
+
+def wait_for_shared(refresh_token, token_hash):
+    deadline = time.time() + LEASE_SECONDS
+    while time.time() < deadline:
+        time.sleep(POLL_INTERVAL_SECONDS)
+        entry = read_shared(refresh_token, token_hash)
+        if is_reusable(entry):
+            return entry
+    return None
+
+
+def call_cognito(fetch, refresh_token):
+    tokens = fetch(refresh_token)
+    if not tokens:
+        return None
+    now = time.time()
+    return {"tokens": tokens, "issued_at": now, "expires_at": now + int(tokens.get("expires_in", 3600))}
+
+
+# ✅ Refresh across containers: reuse a recent result, or let one caller hold the lease while others wait
+def refresh_shared(token_hash, refresh_token, fetch):
+    try:
+        entry = read_shared(refresh_token, token_hash)
+        if is_reusable(entry):
+            return entry
+        if not acquire_lease(token_hash):
+            entry = wait_for_shared(refresh_token, token_hash)
+            if entry:
+                return entry
+            # ✅ The lease holder stalled; refresh directly rather than fail the user
+            return call_cognito(fetch, refresh_token)
+    except Exception as e:
+        logger.warning("Shared refresh tier unavailable, calling Cognito directly: %s", e)
+        return call_cognito(fetch, refresh_token)
+
+    try:
+        entry = call_cognito(fetch, refresh_token)
+    except Exception:
+        release_lease(token_hash)
+        raise
+    if entry:
+        try:
+            store_shared(refresh_token, token_hash, entry)
+        except Exception as e:
+            logger.warning("Failed to share refreshed tokens: %s", e)
+            release_lease(token_hash)
+    else:
+        release_lease(token_hash)
+    return entry
+
+
+def prune_recent():
+    now = time.time()
+    for token_hash in [h for h, entry in recent_tokens.items() if not is_reusable(entry, now)]:
+        recent_tokens.pop(token_hash, None)
+
+
+def get_tokens(refresh_token, fetch):
+    """ ✅ Returns (tokens, seconds_remaining) or (None, 0); fetch(refresh_token) performs the real grant """
+    token_hash = hash_refresh_token(refresh_token)
+    entry = recent_tokens.get(token_hash)
+    if not is_reusable(entry):
+        entry = refresh_shared(token_hash, refresh_token, fetch)
+        if entry:
+            prune_recent()
+            recent_tokens[token_hash] = entry
+
+    if not entry:
+        return None, 0
+    return entry["tokens"], int(entry["expires_at"] - time.time())
@@ -0,0 +1,169 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import jwt
+import requests
+
+from instrumentation import timed
+
+# Setup Logging
+logger = logging.getLogger()
+
+# ✅ Cache Settings
+JWKS_TTL_SECONDS = 6 * 60 * 60  # Cognito rotates signing keys rarely
+JWKS_STALE_SECONDS = 24 * 60 * 60  # Serve old keys this long while a refresh runs
+JWKS_MIN_REFRESH_INTERVAL = 30  # Throttle refreshes triggered by unknown kids
+JWKS_FETCH_TIMEOUT = (2, 3)  # (connect, read) seconds
+VERIFIED_TOKEN_CACHE_SIZE = 1024
+
+
+class JWKSCache:
+    """ ✅ Process-wide JWKS key set indexed by kid, with TTL and stale-while-revalidate """
+
+    def __init__(self, jwks_url, ttl=JWKS_TTL_SECONDS, stale=JWKS_STALE_SECONDS):
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.stale = stale
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self):
+        """ Downloads the JWKS document and parses every RSA signing key """
+        with timed("jwks", "fetch"):
+            response = requests.get(self.jwks_url, timeout=JWKS_FETCH_TIMEOUT)
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            kid = jwk.get("kid")
+            if not kid or jwk.get("use", "sig") != "sig":
+                continue
+            try:
+                keys[kid] = jwt.PyJWK(jwk).key
+            except jwt.PyJWKError:
+                logger.warning("Skipping unparseable JWK %s", kid)
+        if not keys:
+            raise jwt.PyJWKClientError("JWKS document contains no signing keys")
+        return keys
+
+    def refresh(self):
+        """ Reloads the key set; keeps the previous keys if the endpoint fails """
+        with self._lock:
+            self._last_attempt = time.monotonic()
+        try:
+            keys = self._fetch()
+        except Exception as e:
+            logger.warning("JWKS refresh failed, keeping cached keys: %s", e)
+            return False
+        finally:
+            self._refreshing = False
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def get_signing_key(self, kid):
+        """ Returns the key for kid, refreshing on expiry or when the kid is unknown """
+        age = time.monotonic() - self._fetched_at
+        if not self._keys or age > self.ttl + self.stale:
+            self.refresh()
+        elif age > self.ttl:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._last_attempt > JWKS_MIN_REFRESH_INTERVAL:
+            # ✅ Unknown kid usually means Cognito rotated keys
+            self.refresh()
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.PyJWKClientError(f"Unable to find a signing key that matches: {kid}")
+        return key
+
+
+class VerifiedTokenCache:
+    """ ✅ Bounded LRU of already-verified tokens, valid until each token's exp """
+
+    def __init__(self, max_size=VERIFIED_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(token, audience):
+        return hashlib.sha256(f"{audience}|{token}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            claims, exp = entry
+            if exp <= time.time():
+                del self._entries[key]
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            self._entries.move_to_end(key)
+            return dict(claims)
+
+    def put(self, key, claims):
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._entries[key] = (claims, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# ✅ Shared caches (survive across warm invocations)
+_jwks_caches = {}
+_jwks_caches_lock = threading.Lock()
+verified_tokens = VerifiedTokenCache()
+
+
+def get_jwks_cache(jwks_url):
+    """ ✅ Returns the process-wide JWKS cache for a user pool """
+    cache = _jwks_caches.get(jwks_url)
+    if cache is None:
+        with _jwks_caches_lock:
+            cache = _jwks_caches.setdefault(jwks_url, JWKSCache(jwks_url))
+    return cache
+
+
+def verify_token(token, jwks_url, audience, algorithms=("RS256",)):
+    """ ✅ Verifies a Cognito JWT and returns its claims; raises jwt exceptions on failure """
+    cache_key = VerifiedTokenCache.cache_key(token, audience)
+    claims = verified_tokens.get(cache_key)
+    if claims is not None:
+        return claims
+
+    kid = jwt.get_unverified_header(token).get("kid")
+    if not kid:
+        raise jwt.InvalidTokenError("Token header is missing kid")
+    signing_key = get_jwks_cache(jwks_url).get_signing_key(kid)
+
+    claims = jwt.decode(
+        token,
+        signing_key,
+        algorithms=list(algorithms),
+        audience=audience,
+        options={"verify_aud": True},
+    )
+    verified_tokens.put(cache_key, claims)
+    return dict(claims)